@@ -0,0 +1,540 @@
+"""Локальные заменители внешних сервисов для нагрузочного теста.
+
+FixtureServer — минимальный HTTP/1.1-сервер на asyncio с keep-alive.
+На нём работают FakeAniLibria (API и постеры) и FakeQBittorrent (WebUI
+API v2 с имитацией загрузки). BotApiRecorder подменяет HTTP-транспорт
+python-telegram-bot: запросы к Bot API не уходят в сеть, а
+записываются, и на них возвращаются правдоподобные ответы. Файлы бот
+загружает в обход python-telegram-bot, их принимает BotApiUploads.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from telegram.request import BaseRequest
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 415: "Unsupported Media Type"}
+
+
+class FixtureRequest:
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.form = self._parse_form()
+
+    def _parse_form(self):
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {k: v[-1] for k, v in parse_qs(self.body.decode("utf-8")).items()}
+        if content_type.startswith("multipart/form-data"):
+            return _parse_multipart(self.body, content_type)
+        return {}
+
+    def param(self, name, default=None):
+        if name in self.form:
+            return self.form[name]
+        values = self.query.get(name)
+        return values[-1] if values else default
+
+
+def _parse_multipart(body, content_type):
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    form = {}
+    for part in body.split(b"--" + boundary):
+        head, _, value = part.partition(b"\r\n\r\n")
+        marker = b'name="'
+        start = head.find(marker)
+        if start < 0:
+            continue
+        name = head[start + len(marker):head.index(b'"', start + len(marker))].decode()
+        if b"filename=" not in head:
+            form[name] = value.rstrip(b"\r\n").decode("utf-8", "replace")
+    return form
+
+
+class FixtureServer:
+    """HTTP-сервер с маршрутами (метод, путь) -> async handler(request).
+
+    handler возвращает (status, content_type, body). Перед каждым ответом
+    выдерживается latency ± jitter секунд.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.routes = {}
+        self.prefixes = []
+        self.requests = 0
+        self._server = None
+        self._connections = {}  # задача соединения -> writer
+        self.port = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    def route_prefix(self, method, prefix, handler):
+        self.prefixes.append((method, prefix, handler))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Соединения keep-alive остаются открытыми, закрываем их сами
+            for writer in list(self._connections.values()):
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    def _resolve(self, method, path):
+        handler = self.routes.get((method, path))
+        if handler is not None:
+            return handler
+        for route_method, prefix, handler in self.prefixes:
+            if route_method == method and path.startswith(prefix):
+                return handler
+        return None
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                url = urlsplit(target)
+                request = FixtureRequest(method, url.path, parse_qs(url.query), headers, body)
+                self.requests += 1
+                delay = self.latency + random.uniform(-self.jitter, self.jitter)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                handler = self._resolve(method, url.path)
+                if handler is None:
+                    status, content_type, payload = 404, "text/plain", b"Not Found"
+                else:
+                    status, content_type, payload = await handler(request)
+                if isinstance(payload, str):
+                    payload = payload.encode("utf-8")
+                elif not isinstance(payload, bytes):
+                    payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Set-Cookie: SID=bench; path=/\r\n"
+                    f"\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+
+_WORDS = [
+    "sora", "kimi", "hoshi", "yoru", "tsuki", "kaze", "hana", "yume", "umi", "mirai",
+    "shiro", "kuro", "akai", "ao", "hikari", "kage", "natsu", "fuyu", "haru", "aki",
+]
+
+
+class FakeAniLibria(FixtureServer):
+    """API AniLibria v1 на сгенерированном каталоге из releases релизов.
+
+    Поиск возвращает релизы, в названии которых есть все слова запроса.
+    Постеры отдаются по тому же адресу, что и API.
+    """
+
+    def __init__(self, releases=500, torrents_per_release=2, seed=1, **kwargs):
+        super().__init__(**kwargs)
+        rng = random.Random(seed)
+        self.releases = {}
+        for release_id in range(1, releases + 1):
+            name = " ".join(rng.sample(_WORDS, 3)).title()
+            self.releases[release_id] = {
+                "id": release_id,
+                "name": {"main": f"{name} {release_id}", "english": f"{name} {release_id}"},
+                "description": f"Описание релиза {release_id}. " * 5,
+                "poster": {"src": f"/storage/releases/posters/{release_id}/poster.jpg"},
+                "updated_at": "2024-01-01T00:00:00+00:00",
+                "torrents": [
+                    {
+                        "id": release_id * 10 + index,
+                        "hash": hashlib.sha1(f"{release_id}:{index}".encode()).hexdigest(),
+                        "magnet": "magnet:?xt=urn:btih:" + hashlib.sha1(f"{release_id}:{index}".encode()).hexdigest(),
+                        "size": (index + 1) * 700 * 1024 ** 2,
+                        "type": {"description": "WEBRip"},
+                        "quality": {"value": "1080p" if index else "720p"},
+                        "codec": {"value": "AVC"},
+                    }
+                    for index in range(torrents_per_release)
+                ],
+            }
+        self.poster = bytes(rng.getrandbits(8) for _ in range(32 * 1024))
+        self.route("GET", "/api/v1/app/search/releases", self._search)
+        self.route_prefix("GET", "/api/v1/anime/releases/", self._release)
+        self.route_prefix("GET", "/storage/releases/posters/", self._poster)
+
+    def queries(self):
+        """Слова, по которым поиск гарантированно что-то находит."""
+        return list(_WORDS)
+
+    async def _search(self, request):
+        words = (request.param("query") or "").lower().split()
+        found = [
+            {key: release[key] for key in ("id", "name", "description", "poster")}
+            for release in self.releases.values()
+            if words and all(word in release["name"]["main"].lower() for word in words)
+        ]
+        return 200, "application/json", found[:20]
+
+    async def _release(self, request):
+        try:
+            release = self.releases[int(request.path.rsplit("/", 1)[1])]
+        except (KeyError, ValueError):
+            return 404, "application/json", {"error": "not found"}
+        return 200, "application/json", release
+
+    async def _poster(self, request):
+        return 200, "image/jpeg", self.poster
+
+
+class _Torrent:
+    def __init__(self, magnet_hash, save_path, episodes, episode_size, download_time, tags=""):
+        self.hash = magnet_hash
+        self.tags = tags
+        self.name = f"Bench {magnet_hash[:8]}"
+        self.save_path = save_path
+        self.files = [f"{self.name}/Episode {index:02d}.mkv" for index in range(1, episodes + 1)]
+        self.episode_size = episode_size
+        self.download_time = download_time
+        self.added = time.monotonic()
+        self.added_on = int(time.time())
+        self.written = set()
+
+    @property
+    def progress(self):
+        if self.download_time <= 0:
+            return 1.0
+        return min(1.0, (time.monotonic() - self.added) / self.download_time)
+
+    def file_progress(self, index):
+        # Последовательная загрузка: файлы докачиваются по порядку
+        share = 1 / len(self.files)
+        return max(0.0, min(1.0, (self.progress - index * share) / share))
+
+    def materialize(self):
+        """Создаёт на диске файлы, загрузка которых завершилась."""
+        for index, name in enumerate(self.files):
+            if index in self.written or self.file_progress(index) < 1:
+                continue
+            path = os.path.join(self.save_path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(os.urandom(self.episode_size))
+            self.written.add(index)
+
+    def info(self):
+        progress = self.progress
+        return {
+            "hash": self.hash,
+            "name": self.name,
+            "progress": progress,
+            "state": "uploading" if progress >= 1 else "downloading",
+            "save_path": self.save_path,
+            "content_path": os.path.join(self.save_path, self.name),
+            "size": self.episode_size * len(self.files),
+            "completed": self.episode_size * len(self.written),
+            "added_on": self.added_on,
+            "tags": self.tags,
+            "dlspeed": 0 if progress >= 1 else 10 * 1024 ** 2,
+        }
+
+
+class FakeQBittorrent(FixtureServer):
+    """WebUI API v2 qBittorrent, имитирующий последовательную загрузку.
+
+    Каждый добавленный торрент состоит из episodes файлов и докачивается
+    за download_time секунд; готовые файлы записываются в save_path.
+    /sync/maindata отдаёт изменения по rid, как настоящий клиент.
+    """
+
+    def __init__(self, save_path, episodes=3, episode_size=64 * 1024, download_time=5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.save_path = save_path
+        self.episodes = episodes
+        self.episode_size = episode_size
+        self.download_time = download_time
+        self.torrents = {}
+        self._rid = 0
+        self._snapshots = {}  # rid -> {hash: info}, чтобы отдавать разницу
+        self._removed = []  # (rid, hash)
+        self.calls = {}
+        for path, handler in {
+            "/api/v2/auth/login": self._login,
+            "/api/v2/app/version": self._version,
+            "/api/v2/app/webapiVersion": self._webapi_version,
+            "/api/v2/torrents/add": self._add,
+            "/api/v2/torrents/info": self._info,
+            "/api/v2/torrents/files": self._files,
+            "/api/v2/torrents/delete": self._delete,
+            "/api/v2/sync/maindata": self._maindata,
+        }.items():
+            self.route("GET", path, self._counted(path, handler))
+            self.route("POST", path, self._counted(path, handler))
+
+    def _counted(self, path, handler):
+        async def wrapper(request):
+            name = path.rsplit("/", 1)[1]
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return await handler(request)
+        return wrapper
+
+    async def _login(self, request):
+        return 200, "text/plain", "Ok."
+
+    async def _version(self, request):
+        return 200, "text/plain", "v4.6.0"
+
+    async def _webapi_version(self, request):
+        return 200, "text/plain", "2.9.3"
+
+    async def _add(self, request):
+        for url in (request.param("urls") or "").split("\n"):
+            if "btih:" not in url:
+                continue
+            magnet_hash = url.split("btih:", 1)[1].split("&", 1)[0].lower()
+            if magnet_hash not in self.torrents:
+                self.torrents[magnet_hash] = _Torrent(
+                    magnet_hash, self.save_path, self.episodes, self.episode_size, self.download_time,
+                    tags=request.param("tags", "")
+                )
+        return 200, "text/plain", "Ok."
+
+    def _hashes(self, request):
+        value = request.param("hashes") or request.param("hash") or ""
+        return [h.lower() for h in value.split("|") if h]
+
+    async def _info(self, request):
+        hashes = self._hashes(request)
+        tag = request.param("tag")
+        torrents = [
+            t for h, t in self.torrents.items()
+            if (not hashes or h in hashes) and (tag is None or tag in t.tags.split(","))
+        ]
+        for torrent in torrents:
+            await asyncio.to_thread(torrent.materialize)
+        return 200, "application/json", [torrent.info() for torrent in torrents]
+
+    async def _files(self, request):
+        hashes = self._hashes(request)
+        torrent = self.torrents.get(hashes[0]) if hashes else None
+        if torrent is None:
+            return 404, "text/plain", "Not Found"
+        await asyncio.to_thread(torrent.materialize)
+        return 200, "application/json", [
+            {
+                "index": index,
+                "name": name,
+                "size": torrent.episode_size,
+                "progress": torrent.file_progress(index),
+                "priority": 1,
+                "is_seed": False,
+                "piece_range": [0, 0],
+                "availability": 1,
+            }
+            for index, name in enumerate(torrent.files)
+        ]
+
+    async def _delete(self, request):
+        delete_files = request.param("deleteFiles", "false") == "true"
+        for magnet_hash in self._hashes(request):
+            torrent = self.torrents.pop(magnet_hash, None)
+            if torrent is None:
+                continue
+            self._removed.append((self._rid + 1, magnet_hash))
+            if delete_files:
+                for name in torrent.files:
+                    try:
+                        os.remove(os.path.join(torrent.save_path, name))
+                    except FileNotFoundError:
+                        pass
+        return 200, "text/plain", ""
+
+    async def _maindata(self, request):
+        try:
+            rid = int(request.param("rid", 0))
+        except ValueError:
+            rid = 0
+        for torrent in self.torrents.values():
+            await asyncio.to_thread(torrent.materialize)
+        current = {h: t.info() for h, t in self.torrents.items()}
+        previous = self._snapshots.get(rid)
+
+        self._rid += 1
+        self._snapshots[self._rid] = current
+        # Старые снимки больше никому не понадобятся
+        for old_rid in [r for r in self._snapshots if r < self._rid - 16]:
+            del self._snapshots[old_rid]
+
+        if previous is None:
+            return 200, "application/json", {"rid": self._rid, "full_update": True, "torrents": current}
+        delta = {}
+        for magnet_hash, info in current.items():
+            before = previous.get(magnet_hash, {})
+            changed = {key: value for key, value in info.items() if before.get(key) != value}
+            if changed:
+                delta[magnet_hash] = changed
+        removed = [h for removed_rid, h in self._removed if removed_rid > rid]
+        return 200, "application/json", {"rid": self._rid, "torrents": delta, "torrents_removed": removed}
+
+
+class BotApiRecorder(BaseRequest):
+    """HTTP-транспорт python-telegram-bot, который отвечает сам.
+
+    Каждый вызов Bot API записывается в calls как (метод, chat_id,
+    длительность). latency — задержка ответа, upload_bandwidth — скорость
+    «загрузки» файлов в байтах в секунду (None — без ограничения).
+    Последнее сообщение каждого чата с клавиатурой доступно через
+    last_message(), чтобы имитатор пользователя нажимал реальные кнопки.
+    """
+
+    def __init__(self, latency=0.0, upload_bandwidth=None):
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.calls = []
+        self.uploaded_bytes = 0
+        self._message_id = 0
+        self._file_id = 0
+        self._messages = {}  # chat_id -> последнее сообщение бота
+        # Загрузки файлов записываются из потока BotApiUploads
+        self._lock = threading.Lock()
+        self.bot_user = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def last_message(self, chat_id):
+        return self._messages.get(chat_id)
+
+    def _message(self, params, **fields):
+        chat_id = int(params["chat_id"])
+        message_id = params.get("message_id")
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.bot_user,
+            **fields,
+        }
+        if "reply_markup" in params:
+            markup = params["reply_markup"]
+            message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        self._messages[chat_id] = message
+        return message
+
+    def _new_file(self, prefix):
+        self._file_id += 1
+        return {"file_id": f"{prefix}{self._file_id}", "file_unique_id": f"u{prefix}{self._file_id}", "file_size": 1}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        started = time.perf_counter()
+        endpoint = url.rsplit("/", 1)[1]
+        params = request_data.parameters if request_data is not None else {}
+
+        uploaded = 0
+        if request_data is not None and request_data.contains_files:
+            uploaded = sum(len(value[1]) for value in request_data.multipart_data.values())
+        delay = self.latency
+        if uploaded and self.upload_bandwidth:
+            delay += uploaded / self.upload_bandwidth
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        self.record(endpoint, params, uploaded, started)
+        return 200, json.dumps({"ok": True, "result": self.respond(endpoint, params)}).encode("utf-8")
+
+    def respond(self, endpoint, params):
+        with self._lock:
+            if endpoint == "getMe":
+                return self.bot_user
+            if endpoint in ("sendMessage", "editMessageText"):
+                return self._message(params, text=params.get("text", ""))
+            if endpoint == "sendDocument":
+                return self._message(params, document=self._new_file("doc"), caption=params.get("caption", ""))
+            if endpoint == "editMessageMedia":
+                return self._message(params, photo=[{**self._new_file("photo"), "width": 320, "height": 480}])
+            # answerCallbackQuery, deleteMessage и прочие возвращают True
+            return True
+
+    def record(self, endpoint, params, uploaded, started):
+        with self._lock:
+            self.uploaded_bytes += uploaded
+            self.calls.append((endpoint, params.get("chat_id"), time.perf_counter() - started))
+
+
+class BotApiUploads(FixtureServer):
+    """Приём файлов, которые бот загружает в Bot API потоком, минуя BotApiRecorder.
+
+    Вызовы записываются в тот же recorder; скорость загрузки ограничивается
+    его upload_bandwidth.
+    """
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+        self.route_prefix("POST", "/bot", self._handle)
+
+    async def _handle(self, request):
+        started = time.perf_counter()
+        endpoint = request.path.rsplit("/", 1)[1]
+        uploaded = len(request.body)
+        if self.recorder.upload_bandwidth:
+            await asyncio.sleep(uploaded / self.recorder.upload_bandwidth)
+        if "chat_id" not in request.form:
+            return 400, "application/json", {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"}
+        self.recorder.record(endpoint, request.form, uploaded, started)
+        return 200, "application/json", {"ok": True, "result": self.recorder.respond(endpoint, request.form)}
@@ -0,0 +1,419 @@
+"""Нагрузочный тест бота на локальных заменителях Telegram, AniLibria и qBittorrent.
+
+Запуск из корня репозитория:
+
+    python -m bench.load --users 50 --rounds 2 --download-share 0.2
+
+Каждый имитируемый пользователь проходит сценарий /start → «Поиск» →
+текст запроса → карточка релиза и (с вероятностью --download-share) →
+выбор качества → скачивание, нажимая кнопки, которые бот ему реально
+прислал. Обновления проходят через PerChatUpdateProcessor и
+Application.process_update, то есть через те же обработчики и ту же
+параллельную обработку, что и в main.py. Длительность скачивания
+(фоновая задача) входит в общее время прогона, но не в время обработчика.
+
+В отчёте: p50/p99/max длительности каждого обработчика, пропускная
+способность, число вызовов Bot API и время, на которое блокировался
+event loop (паузы длиннее --block-threshold мс). Последнее ловит
+синхронные вызовы вроде time.sleep или requests в обработчиках.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from itertools import count
+
+from bench.fakes import BotApiRecorder, BotApiUploads, FakeAniLibria, FakeQBittorrent
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько позже запланированного просыпается event loop.
+
+    Задержка больше threshold считается блокировкой loop.
+    """
+
+    def __init__(self, interval=0.01, threshold=0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = []
+        self.blocked = 0.0
+        self.stalls = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            self.lags.append(lag)
+            if lag > self.threshold:
+                self.blocked += lag
+                self.stalls += 1
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class FixtureThread:
+    """Заменители внешних сервисов в отдельном потоке со своим event loop.
+
+    Так их работа не попадает в измерения задержек event loop бота.
+    """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self._loop = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._main, name="bench-fixtures", daemon=True)
+
+    def _main(self):
+        self._loop = asyncio.new_event_loop()
+        for server in self.servers:
+            self._loop.run_until_complete(server.start())
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        async def shutdown():
+            for server in self.servers:
+                await server.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class SimulatedUser:
+    """Пользователь Telegram, который проходит сценарий через обработчики бота."""
+
+    _update_ids = count(1)
+
+    def __init__(self, driver, user_id, rng):
+        self.driver = driver
+        self.user_id = user_id
+        self.rng = rng
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+        self._message_id = 0
+
+    def _message(self, text):
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def _callback(self, data):
+        message = self.driver.recorder.last_message(self.user_id)
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user,
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": message,
+            },
+        }
+
+    def buttons(self):
+        message = self.driver.recorder.last_message(self.user_id) or {}
+        keyboard = (message.get("reply_markup") or {}).get("inline_keyboard") or []
+        return [button["callback_data"] for row in keyboard for button in row if "callback_data" in button]
+
+    def press(self, prefix):
+        for data in self.buttons():
+            if data.startswith(prefix):
+                return data
+        return None
+
+    async def run(self, rounds, download_share, think_time):
+        driver = self.driver
+        for _ in range(rounds):
+            await driver.send("start", self._message("/start"))
+            await self._think(think_time)
+            if not self.press("search"):
+                driver.failures += 1
+                continue
+            await driver.send("button:search", self._callback("search"))
+            await self._think(think_time)
+            await driver.send("text", self._message(self.rng.choice(driver.queries)))
+            await self._think(think_time)
+
+            anime = self.press("animeID_")
+            if anime is None:
+                driver.failures += 1
+                continue
+            await driver.send("button:animeID", self._callback(anime))
+            await self._think(think_time)
+            if self.rng.random() >= download_share:
+                continue
+
+            download = self.press("download_")
+            if download is None:
+                driver.failures += 1
+                continue
+            await driver.send("button:download", self._callback(download))
+            await self._think(think_time)
+            quality = self.press("animeDownload_")
+            if quality is None:
+                driver.failures += 1
+                continue
+            await driver.send("button:animeDownload", self._callback(quality))
+
+    async def _think(self, think_time):
+        if think_time > 0:
+            await asyncio.sleep(self.rng.uniform(0, 2 * think_time))
+
+
+class LoadDriver:
+    def __init__(self, app, recorder, queries):
+        self.app = app
+        self.recorder = recorder
+        self.queries = queries
+        self.latencies = {}
+        self.failures = 0
+        self.errors = 0
+
+    async def send(self, kind, data):
+        from telegram import Update
+
+        update = Update.de_json(data, self.app.bot)
+        started = time.perf_counter()
+        try:
+            # Так же, как Application передаёт обновления при concurrent_updates
+            await self.app.update_processor.process_update(update, self.app.process_update(update))
+        except Exception as e:
+            self.errors += 1
+            logging.getLogger(__name__).error(f"Обработчик {kind} завершился ошибкой: {e}")
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+
+def configure(args, workdir, anilibria, qbittorrent):
+    """Импортирует бота внутри workdir и направляет его на заменители."""
+    os.chdir(workdir)
+    os.environ.setdefault("STATE_BACKEND", args.state)
+
+    import qbittorrentapi
+    import service.api
+    import service.posters
+    import service.progress
+    from service.qbit import qb, tracker
+
+    service.api.API = f"{anilibria.url}/api/v1"
+    service.posters.POSTER_BASE_URL = anilibria.url
+    qb.client = qbittorrentapi.Client(
+        host="127.0.0.1", port=qbittorrent.port, username="bench", password="bench",
+        REQUESTS_ARGS={"timeout": 30}
+    )
+    tracker.interval = args.poll_interval
+    service.progress.MIN_EDIT_INTERVAL = min(service.progress.MIN_EDIT_INTERVAL, args.poll_interval)
+
+    # Логи бота в файле рабочей директории не нужны, в консоль — только предупреждения
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.FileHandler):
+            root.removeHandler(handler)
+            handler.close()
+    root.setLevel(getattr(logging, args.log_level))
+
+
+async def run(args, workdir, anilibria, qbittorrent, recorder, uploads):
+    configure(args, workdir, anilibria, qbittorrent)
+
+    from telegram.ext import ApplicationBuilder
+    import main
+    from service.cluster import CONCURRENT_UPDATES
+    from service.metrics import registry
+    from service.scheduler import PerChatUpdateProcessor, TelegramRateLimiter
+
+    # Файлы бот загружает сам по bot.base_url, остальные запросы идут через recorder
+    builder = (
+        ApplicationBuilder().token("1:bench").base_url(f"{uploads.url}/bot").request(recorder).updater(None)
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+    )
+    if args.rate_limit:
+        builder = builder.rate_limiter(TelegramRateLimiter())
+    app = builder.build()
+    main.add_handlers(app)
+
+    await app.initialize()
+    await main.on_startup(app)
+    await app.start()
+
+    driver = LoadDriver(app, recorder, anilibria.queries())
+    rng = random.Random(args.seed)
+    users = [SimulatedUser(driver, 100000 + index, random.Random(rng.random())) for index in range(args.users)]
+
+    async def start_user(index, user):
+        # Пользователи подключаются равномерно в течение ramp секунд
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp * index / len(users))
+        await user.run(args.rounds, args.download_share, args.think_time)
+
+    monitor = LoopLagMonitor(threshold=args.block_threshold / 1000)
+    monitor.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(start_user(index, user) for index, user in enumerate(users)))
+        # Скачивания продолжаются в фоне после ответа обработчика
+        while main.background_tasks:
+            await asyncio.gather(*main.background_tasks, return_exceptions=True)
+    finally:
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+        metrics = registry.render() if args.metrics else None
+        await app.stop()
+        await main.on_shutdown(app)
+        await app.shutdown()
+
+    result = report(args, driver, recorder, monitor, anilibria, qbittorrent, elapsed)
+    if metrics is not None:
+        result["metrics"] = metrics
+    return result
+
+
+def report(args, driver, recorder, monitor, anilibria, qbittorrent, elapsed):
+    handled = sum(len(values) for values in driver.latencies.values())
+    bot_calls = {}
+    for endpoint, _, _ in recorder.calls:
+        bot_calls[endpoint] = bot_calls.get(endpoint, 0) + 1
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "elapsed_s": round(elapsed, 3),
+        "updates": handled,
+        "updates_per_s": round(handled / elapsed, 2) if elapsed else 0.0,
+        "errors": driver.errors,
+        "scenario_failures": driver.failures,
+        "handlers": {
+            kind: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2),
+            }
+            for kind, values in sorted(driver.latencies.items())
+        },
+        "event_loop": {
+            "lag_p50_ms": round(percentile(monitor.lags, 50) * 1000, 2),
+            "lag_p99_ms": round(percentile(monitor.lags, 99) * 1000, 2),
+            "lag_max_ms": round(max(monitor.lags, default=0) * 1000, 2),
+            "blocked_ms": round(monitor.blocked * 1000, 2),
+            "stalls": monitor.stalls,
+        },
+        "bot_api_calls": bot_calls,
+        "uploaded_bytes": recorder.uploaded_bytes,
+        "anilibria_requests": anilibria.requests,
+        "qbittorrent_calls": dict(qbittorrent.calls),
+    }
+
+
+def print_report(result):
+    print(f"Пользователей: {result['users']}, раундов: {result['rounds']}, время: {result['elapsed_s']} с")
+    print(f"Обновлений: {result['updates']} ({result['updates_per_s']}/с), ошибок: {result['errors']}, "
+          f"сценариев не завершено: {result['scenario_failures']}")
+    print()
+    print(f"{'обработчик':<24}{'N':>7}{'p50, мс':>12}{'p99, мс':>12}{'max, мс':>12}")
+    for kind, stats in result["handlers"].items():
+        print(f"{kind:<24}{stats['count']:>7}{stats['p50_ms']:>12}{stats['p99_ms']:>12}{stats['max_ms']:>12}")
+    loop = result["event_loop"]
+    print()
+    print(f"Задержка event loop: p50 {loop['lag_p50_ms']} мс, p99 {loop['lag_p99_ms']} мс, max {loop['lag_max_ms']} мс")
+    print(f"Блокировки event loop: {loop['stalls']}, всего {loop['blocked_ms']} мс")
+    print(f"Вызовы Bot API: {result['bot_api_calls']}, загружено байт: {result['uploaded_bytes']}")
+    print(f"Запросы к AniLibria: {result['anilibria_requests']}, вызовы qBittorrent: {result['qbittorrent_calls']}")
+    if "metrics" in result:
+        print()
+        print(result["metrics"], end="")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заменителях сервисов")
+    parser.add_argument("--users", type=int, default=20, help="число одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=1, help="сколько раз каждый проходит сценарий")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument("--download-share", type=float, default=0.1, help="доля сценариев со скачиванием")
+    parser.add_argument("--releases", type=int, default=500, help="размер каталога AniLibria")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа AniLibria, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка ответа Bot API, с")
+    parser.add_argument("--upload-bandwidth", type=float, default=None, help="скорость загрузки файлов, байт/с")
+    parser.add_argument("--qb-latency", type=float, default=0.005, help="задержка ответа qBittorrent, с")
+    parser.add_argument("--download-time", type=float, default=3.0, help="время загрузки торрента, с")
+    parser.add_argument("--episodes", type=int, default=3, help="серий в торренте")
+    parser.add_argument("--episode-size", type=int, default=64 * 1024, help="размер файла серии, байт")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="период опроса qBittorrent, с")
+    parser.add_argument("--rate-limit", action="store_true", help="включить TelegramRateLimiter, как в main.py")
+    parser.add_argument("--state", choices=("memory", "sqlite"), default="sqlite", help="хранилище сессий")
+    parser.add_argument("--block-threshold", type=float, default=50.0, help="порог блокировки event loop, мс")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    parser.add_argument("--metrics", action="store_true", help="добавить в отчёт метрики бота (service.metrics)")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo not in sys.path:
+        sys.path.insert(0, repo)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        anilibria = FakeAniLibria(releases=args.releases, seed=args.seed, latency=args.api_latency)
+        qbittorrent = FakeQBittorrent(
+            os.path.join(workdir, "downloads"), episodes=args.episodes, episode_size=args.episode_size,
+            download_time=args.download_time, latency=args.qb_latency
+        )
+        recorder = BotApiRecorder(latency=args.telegram_latency, upload_bandwidth=args.upload_bandwidth)
+        uploads = BotApiUploads(recorder, latency=args.telegram_latency)
+        fixtures = FixtureThread([anilibria, qbittorrent, uploads])
+        fixtures.start()
+        cwd = os.getcwd()
+        try:
+            result = asyncio.run(run(args, workdir, anilibria, qbittorrent, recorder, uploads))
+        finally:
+            os.chdir(cwd)
+            fixtures.stop()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
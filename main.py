@@ -1,27 +1,37 @@
 import os
-import subprocess
-import platform
 import time
+import signal
+import asyncio
 import logging
-import requests
+import httpx
+from pathlib import Path
 import qbittorrentapi
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaDocument
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 
-from service.api import Anime
-# from service.downloader import Downloader
-
-QB_HOST = "localhost"
-QB_PORT = 8080
-QB_USERNAME = "admin"
-QB_PASSWORD = "adminadmin"
-
-qb = qbittorrentapi.Client(
-    host=QB_HOST,
-    port=QB_PORT,
-    username=QB_USERNAME,
-    password=QB_PASSWORD
+from service.api import Anime, ApiClient
+from service.catalog import CATALOG_ENABLED, ApiCatalogSource, catalog
+from service.qbit import qb, tracker
+from service.tracker import is_complete
+from service.transcoder import MAX_UPLOAD_SIZE, encode_profile, transcoder
+from service.pipeline import TorrentPipeline
+from service.transcode_cache import cache_key, transcode_cache
+from service.file_ids import file_ids
+from service.posters import posters
+from service.state import sessions
+from service.scheduler import PerChatUpdateProcessor, TelegramRateLimiter, downloads, transcodes
+from service.progress import renderer
+from service.jobs import TorrentLeases, jobs
+from service.storage import QB_TAG, storage
+from service.uploader import uploader
+from service.cluster import (
+    ALLOWED_UPDATES, BOT_MODE, BOT_WORKERS, CONCURRENT_UPDATES, WORKER_COUNT, WORKER_INDEX, run_supervisor,
+)
+from service.metrics import (
+    METRICS_PORT, loop_monitor, metrics_server, registry, sampled,
+    telegram_upload_bytes, telegram_upload_seconds, telegram_upload_throughput,
 )
 
 # Настройка логирования
@@ -35,15 +45,12 @@ logging.basicConfig(
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Хранилище для состояния пользователя
-user_states = {}
+# Замени на токен от BotFather или задай переменную окружения BOT_TOKEN
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "7648087080:AAGWbigCK_I9aR4mfdfCw4IqDMweshM2vww")
+
+# Фоновые загрузки, запущенные из обработчиков
+background_tasks = set()
 
-try:
-    qb.auth_log_in()
-    logger.info("Подключено к qBittorrent")
-except qbittorrentapi.LoginFailed:
-    exit()
-    logger.error(f"Ошибка авторизации: {qbittorrentapi.LoginFailed}")
 
 # Функция обработки команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -69,11 +76,11 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Добро пожаловать! Выбери вариант ниже:", reply_markup=reply_markup)
 
     elif query.data == "search":
-        user_states[query.from_user.id] = "waiting_for_search"
+        await sessions.set_state(query.from_user.id, "waiting_for_search")
         await query.edit_message_text("Введите текст для поиска:")
 
     elif query.data == "go_back_search":
-        user_states[query.from_user.id] = "waiting_for_search"
+        await sessions.set_state(query.from_user.id, "waiting_for_search")
         
         # Удаляем предыдущее сообщение (если оно было изображением)
         try:
@@ -92,7 +99,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("Ошибка получения данных об аниме.")
             return
 
-        image_url = f"https://static-libria.weekstorm.one{title[0]['poster']}"
+        poster = title[0]['poster']
         text = f"Название:\n<b>{title[0]['title_name']}</b>\nОписание:\n{title[0]['description']}"
         keyboard = [
             [InlineKeyboardButton("Назад", callback_data="go_back_search")],
@@ -101,14 +108,26 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         try:
-            response = requests.get(image_url, stream=True)  # stream=True для больших файлов
-            response.raise_for_status()  # Проверка на ошибки HTTP (4xx или 5xx)
-
-            # Отправка фото как InputMediaPhoto
-            media = InputMediaPhoto(media=response.raw, caption=text, parse_mode=ParseMode.HTML)
-            await query.edit_message_media(media=media, reply_markup=reply_markup)
-
-        except requests.exceptions.RequestException as e:
+            # file_id, если постер уже отправлялся, иначе файл из локального кэша
+            photo = await posters.get(poster)
+            try:
+                message = await query.edit_message_media(
+                    media=InputMediaPhoto(media=poster_input(photo), caption=text, parse_mode=ParseMode.HTML),
+                    reply_markup=reply_markup
+                )
+            except BadRequest as e:
+                if os.path.exists(photo):
+                    raise
+                logger.warning(f"Сохранённый file_id постера недействителен: {e}")
+                await posters.forget(poster)
+                photo = await posters.get_file(poster)
+                message = await query.edit_message_media(
+                    media=InputMediaPhoto(media=poster_input(photo), caption=text, parse_mode=ParseMode.HTML),
+                    reply_markup=reply_markup
+                )
+            await posters.remember(poster, message)
+
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при скачивании изображения: {e}")
             await query.edit_message_text(f"Ошибка при загрузке изображения: {e}")  # Сообщение об ошибке в чат
         except Exception as e:
@@ -139,82 +158,242 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Пользователь {query.from_user.id} запросил скачивание аниме с ID: {anime_id}")
         magnet, magnet_hash = await Anime.download_torrent(torrent_id, anime_id)
 
-        query = update.callback_query
-        await query.answer()
-        
-        qb.torrents_add(urls=magnet)
-        logger.info(f"Начата загрузка для магнит-ссылки: {magnet}")
-        time.sleep(5)
-        
-        torrents_info = qb.torrents_info(hash=magnet_hash)
-        torrent = next((t for t in torrents_info if t.hash == magnet_hash), None)
-        
-        if not torrent:
-            logger.error(f"Не удалось найти торрент по ссылке: {magnet}")
-            await update.reply_text("Не удалось найти торрент.")
+        # Загрузка идёт в фоне: обработчик не задерживает следующие обновления этого чата
+        run_in_background(deliver_torrent(query, magnet, magnet_hash))
+
+def run_in_background(coroutine):
+    async def run():
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка фоновой задачи: {e}")
+
+    task = asyncio.create_task(run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def deliver_torrent(query, magnet, magnet_hash):
+    """Скачивает (или берёт из кэшей) торрент и отправляет серии в чат."""
+    # Пока серии отправляются, их сжатые файлы не вытесняются из кэша по бюджету диска
+    with transcode_cache.pinned(magnet_hash):
+        await send_torrent(query, magnet, magnet_hash)
+
+async def send_torrent(query, magnet, magnet_hash):
+    profile = encode_profile(MAX_UPLOAD_SIZE)
+    torrent_key = f"{magnet_hash.lower()}:{profile}"
+    # Уже отправленные части: запасные пути продолжают с места сбоя, а не с первой серии
+    delivered = set()
+
+    # Торрент уже отправлялся: пересылаем по file_id, ничего не загружая в Telegram
+    sent_files = await file_ids.get_torrent(torrent_key)
+    if sent_files:
+        logger.info(f"Торрент {magnet_hash} отправляется по сохранённым file_id")
+        await query.edit_message_text("Отправка медиа...")
+        if await send_cached_files(
+            query, magnet_hash, profile, [(name, [None] * count) for name, count in sent_files], delivered
+        ):
             return
 
-        while torrent.state != "seeding":
-            torrents = qb.torrents_info()
-            torrent = next((t for t in torrents if t.hash == magnet_hash), None)
-            progress = torrent.progress * 100
-            logger.info(f"Прогресс загрузки: {progress}%")
-            if progress >= 100:
-                logger.info("Загрузка завершена, отправка медиа...")
-                await query.edit_message_text("Загрузка завершена, отправка медиа...")
-                break
-            await query.edit_message_text(f"Загрузка: {progress:.2f}%")
-            time.sleep(5)
-
-        files = qb.torrents_files(torrent.hash)
-        sorted_files = sorted(files, key=lambda f: f.name)
-
-        for file in sorted_files:
-            file_path = os.path.join(torrent.save_path, file.name)
-            compressed_path = file_path.replace(".mp4", "_compressed.mp4")
-
-            logger.info(f"Сжимаем видео: {file.name}")
-            compressed_video = compress_video(file_path, compressed_path)
-            
-            if compressed_video:
-                logger.info(f"Отправка сжатого файла: {compressed_video}")
-                with open(compressed_video, "rb") as f:
-                    media = InputMediaDocument(f)
-                    await query.message.reply_document(media, caption=f"Сжатая версия {file.name}")
-            else:
-                logger.warning(f"Не удалось сжать файл: {file.name}, отправляется оригинал.")
-                with open(file_path, "rb") as f:
-                    media = InputMediaDocument(f)
-                    await query.message.reply_document(media, caption=f"Оригинал {file.name}")
-        
-        qb.torrents_remove(hashes=[torrent.hash])
-        logger.info(f"Торрент {torrent.hash} удален после отправки файлов.")
-
-def compress_video(input_path, output_path):
-    max_size = 50 * 1024 * 1024  # 50MB
-    
-    # Определяем команду для FFmpeg в зависимости от ОС
-    if platform.system() == "Windows":
-        ffmpeg_cmd = [
-            "ffmpeg.exe", "-i", input_path,
-            "-c:v", "libx264", "-b:v", "500k", "-c:a", "aac", "-b:a", "128k", 
-            "-preset", "fast", output_path
-        ]
-    else:
-        # Linux версия (закомментирована)
-        # ffmpeg_cmd = [
-        #     "ffmpeg", "-i", input_path,
-        #     "-c:v", "libx264", "-b:v", "500k", "-c:a", "aac", "-b:a", "128k", 
-        #     "-preset", "fast", output_path
-        # ]
-        pass
-    
-    subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-    if os.path.getsize(output_path) > max_size:
-        print("Файл все еще больше 50MB, попробуйте уменьшить битрейт.")
+    # Если все серии уже сжаты ранее, отправляем их из кэша без qBittorrent и ffmpeg
+    cached_files = await transcode_cache.get_torrent(magnet_hash, profile)
+    if cached_files:
+        logger.info(f"Торрент {magnet_hash} найден в кэше сжатых файлов")
+        await query.edit_message_text("Отправка медиа...")
+        if await send_cached_files(query, magnet_hash, profile, cached_files, delivered):
+            await file_ids.put_torrent(torrent_key, [(name, len(parts)) for name, parts in cached_files])
+            return
+
+    async def on_status(text, final=False):
+        # Правки объединяются и отправляются с учётом лимитов Telegram
+        if final:
+            await renderer.finish(query.message, text)
+        else:
+            renderer.update(query.message, text)
+
+    async def on_episode(file_name, file_path, parts):
+        if parts:
+            await send_parts(query, magnet_hash, profile, file_name, parts, delivered)
+        elif f"original:{file_name}" not in delivered:
+            logger.warning(f"Не удалось сжать файл: {file_name}, отправляется оригинал.")
+            await upload_document(query.message, file_path, f"Оригинал {file_name}")
+            delivered.add(f"original:{file_name}")
+
+    # Один торрент качается один раз: повторные запросы подключаются к идущей загрузке
+    try:
+        results = await jobs.run(
+            magnet_hash,
+            lambda job: run_download(job, query.from_user.id, magnet, magnet_hash, profile),
+            on_status, on_episode,
+            # С несколькими обработчиками торрент может загружать другой процесс
+            follower=lambda job: follow_download(job, magnet_hash, profile),
+            on_wait=lambda job: watch_download(job, magnet_hash)
+        )
+    finally:
+        renderer.forget(query.message)
+
+    if results is None:
+        logger.error(f"Не удалось найти торрент по ссылке: {magnet}")
+        await renderer.finish(query.message, "Не удалось найти торрент.")
+        return
+
+    if results and all(parts for _, parts in results):
+        await file_ids.put_torrent(torrent_key, [(name, len(parts)) for name, parts in results])
+
+async def follow_download(job, magnet_hash, profile):
+    """Торрент загрузил другой процесс-обработчик: серии берём из кэша сжатых файлов."""
+    cached_files = await transcode_cache.get_torrent(magnet_hash, profile)
+    if cached_files is None:
         return None
-    return output_path
+    await job.publish_status("Загрузка завершена, отправка медиа...", final=True)
+    for file_name, parts in cached_files:
+        job.publish_episode(file_name, None, parts)
+    return cached_files
+
+async def watch_download(job, magnet_hash):
+    """Пока торрент загружает другой процесс, показываем его прогресс из qBittorrent.
+
+    Ожидающие загрузки опрашивают qBittorrent одновременно, и qb.info
+    объединяет их запросы в один torrents_info.
+    """
+    torrent = await qb.info(magnet_hash)
+    if torrent is None:
+        return
+    if is_complete(torrent):
+        await job.publish_status("Загрузка завершена, идёт сжатие...")
+    else:
+        await job.publish_status(f"Загрузка: {torrent.get('progress', 0) * 100:.2f}%")
+
+async def run_download(job, user_id, magnet, magnet_hash, profile):
+    async def on_position(position):
+        await job.publish_status(f"Загрузка в очереди, позиция: {position}")
+
+    async def on_disk_wait():
+        await job.publish_status("Ожидание свободного места на диске...")
+
+    # Число одновременных загрузок ограничено, очередь делится между пользователями поровну
+    async with downloads.slot(user_id, on_position=on_position):
+        await storage.begin_work(magnet_hash)
+        try:
+            # Перед новой загрузкой освобождаем место от торрентов, которые уже никому не нужны
+            await storage.wait_for_room(magnet_hash, on_wait=on_disk_wait)
+
+            # Последовательная загрузка: первые серии скачиваются первыми и сразу уходят на сжатие.
+            # Метка отличает торренты бота от остальных при очистке диска
+            await qb.add(magnet, tags=QB_TAG, is_sequential_download=True, is_first_last_piece_priority=True)
+            logger.info(f"Начата загрузка для магнит-ссылки: {magnet}")
+
+            last_progress = None
+
+            async def on_progress(torrent):
+                nonlocal last_progress
+                progress = torrent.get("progress", 0) * 100
+                if is_complete(torrent):
+                    logger.info("Загрузка завершена, отправка медиа...")
+                    await job.publish_status("Загрузка завершена, отправка медиа...", final=True)
+                elif progress != last_progress:
+                    last_progress = progress
+                    # Прогресс меняется на каждом опросе — в INFO попадает только раз в LOG_SAMPLE_INTERVAL
+                    level = logging.INFO if sampled(f"progress:{magnet_hash}") else logging.DEBUG
+                    logger.log(
+                        level, f"Прогресс загрузки {magnet_hash}: {progress:.2f}%",
+                        extra={"magnet_hash": magnet_hash, "progress": progress}
+                    )
+                    await job.publish_status(f"Загрузка: {progress:.2f}%")
+
+            async def on_episode(file_name, file_path, parts):
+                job.publish_episode(file_name, file_path, parts)
+
+            # Серия N отправляется, пока сжимается серия N+1 и докачиваются остальные
+            pipeline = TorrentPipeline(
+                magnet_hash, profile, user_id=user_id,
+                on_progress=on_progress, on_episode=on_episode
+            )
+            results = await pipeline.run()
+        finally:
+            # Сжатые серии уже в кэше, неудачные попытки ffmpeg больше не нужны
+            await storage.finish_work(magnet_hash)
+
+    if results and all(parts for _, parts in results):
+        await transcode_cache.put_torrent(magnet_hash, profile, [name for name, _ in results])
+    # Торрент удаляется реестром, когда файлы получат все подписчики
+    return results
+
+def poster_input(photo):
+    # Локальный файл передаём как Path, иначе строка считается file_id
+    return Path(photo) if os.path.exists(photo) else photo
+
+async def upload_document(message, path, caption):
+    """Загружает файл с диска в чат и учитывает скорость загрузки в метриках.
+
+    Файл читается с диска кусками прямо в запрос, не загружаясь в память целиком.
+    """
+    size = await asyncio.to_thread(os.path.getsize, path)
+    started = time.monotonic()
+    sent = await uploader.send_document(
+        message.get_bot(), message.chat_id, path, caption=caption,
+        message_thread_id=message.message_thread_id if message.is_topic_message else None,
+        # Как reply_document: в группах ответ цитирует сообщение
+        reply_to=message.message_id if message.chat.type != "private" else None,
+    )
+    elapsed = time.monotonic() - started
+    telegram_upload_seconds.observe(elapsed)
+    telegram_upload_bytes.inc(size)
+    if elapsed > 0:
+        telegram_upload_throughput.observe(size / elapsed)
+    return sent
+
+def part_key(magnet_hash, file_name, profile, index):
+    return f"{cache_key(magnet_hash, file_name, profile)}:{index}"
+
+async def send_parts(query, magnet_hash, profile, file_name, parts, delivered=None):
+    """Отправляет части сжатого файла.
+
+    Если часть уже загружалась в Telegram, она отправляется по file_id.
+    Элемент parts может быть None, когда файла на диске нет — тогда
+    без сохранённого file_id выбрасывается FileNotFoundError.
+    Части, ключи которых есть в delivered, пропускаются; отправленные
+    добавляются туда же.
+    """
+    if delivered is None:
+        delivered = set()
+    for index, compressed_video in enumerate(parts, start=1):
+        key = part_key(magnet_hash, file_name, profile, index)
+        if key in delivered:
+            continue
+
+        caption = f"Сжатая версия {file_name}"
+        if len(parts) > 1:
+            caption += f" (часть {index}/{len(parts)})"
+
+        file_id = await file_ids.get(key)
+        if file_id:
+            try:
+                await query.message.reply_document(file_id, caption=caption)
+                delivered.add(key)
+                continue
+            except BadRequest as e:
+                logger.warning(f"Сохранённый file_id для {file_name} недействителен: {e}")
+                await file_ids.delete(key)
+
+        if compressed_video is None:
+            raise FileNotFoundError(f"Нет ни file_id, ни файла для {file_name} (часть {index})")
+
+        logger.info(f"Отправка сжатого файла: {compressed_video}")
+        message = await upload_document(query.message, compressed_video, caption)
+        delivered.add(key)
+        await file_ids.put(key, message.document.file_id)
+
+async def send_cached_files(query, magnet_hash, profile, files, delivered=None):
+    try:
+        for file_name, parts in files:
+            await send_parts(query, magnet_hash, profile, file_name, parts, delivered)
+        return True
+    except FileNotFoundError as e:
+        logger.warning(f"{e}, торрент будет обработан заново")
+        return False
 
 # Обработка текстового ввода
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -222,7 +401,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Пользователь {user_id} ввел текст: {update.message.text}")
 
     # Проверяем, ожидает ли пользователь ввода текста для поиска
-    if user_states.get(user_id) == "waiting_for_search":
+    session = await sessions.get(user_id)
+    if session.state == "waiting_for_search":
         user_query = update.message.text
         try:
             anime_list = await Anime.search(user_query)
@@ -230,7 +410,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             anime_list = None  # Если произошла ошибка, обрабатываем как пустой результат
             logger.error(f"Ошибка при поиске аниме: {e}")  # Логируем ошибку для отладки
 
-        user_states[user_id] = None  # Сбрасываем состояние пользователя
+        session.state = None  # Сбрасываем состояние пользователя
+        await session.save()
 
         # Формируем кнопки с результатами поиска или ошибкой
         if anime_list:
@@ -241,6 +422,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard.append([InlineKeyboardButton("Назад", callback_data="go_back_search")])
             reply_markup = InlineKeyboardMarkup(keyboard)
             await update.message.reply_text("Найденные аниме:", reply_markup=reply_markup)
+            # Пока пользователь выбирает, загружаем релизы и постеры первых результатов
+            context.application.create_task(posters.prefetch_titles([anime["id"] for anime in anime_list]))
         else:
             keyboard = [[InlineKeyboardButton("Назад", callback_data="go_back")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -248,16 +431,123 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("Нажмите 'Поиск', чтобы начать поиск.")
 
-# Основной блок
-if __name__ == '__main__':
-    logger.info("Запуск бота...")
-    # Замени 'YOUR_TOKEN' на токен от BotFather
-    app = ApplicationBuilder().token("7648087080:AAGWbigCK_I9aR4mfdfCw4IqDMweshM2vww").connect_timeout(120).build()
-
-    # Регистрируем обработчики
+# Авторизуемся в qBittorrent до приёма обновлений
+async def on_startup(app):
+    try:
+        await qb.login()
+    except qbittorrentapi.LoginFailed as e:
+        logger.error(f"Ошибка авторизации: {e}")
+        raise SystemExit(1)
+    if WORKER_COUNT == 1:
+        # С несколькими обработчиками это делает супервизор до их запуска
+        await storage.cleanup_orphans()
+    storage.start()
+    if CATALOG_ENABLED:
+        catalog.start(ApiCatalogSource(ApiClient.get_json))
+    loop_monitor.start()
+    if METRICS_PORT:
+        try:
+            # Метрики у каждого обработчика свои, поэтому и порт свой
+            await metrics_server.start(port=METRICS_PORT + WORKER_INDEX)
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик: {e}")
+
+# Попадания в кэши и глубина очередей берутся из их stats() при каждом запросе /metrics
+registry.stats("cache", lambda: [*Anime.cache_stats(), posters.stats(), transcode_cache.stats(), file_ids.stats()])
+registry.stats("admission", lambda: [downloads.stats(), transcodes.stats()])
+registry.stats("transcoder", transcoder.stats)
+registry.stats("download_jobs", jobs.stats)
+registry.stats("progress_edits", renderer.stats)
+registry.stats("tracker", tracker.stats)
+registry.stats("background", lambda: {"tasks": len(background_tasks)})
+registry.stats("storage", storage.stats)
+
+# Закрываем общие соединения при остановке бота
+async def on_shutdown(app):
+    # Незавершённые загрузки прерываем: торренты и кэши переживут перезапуск
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await metrics_server.stop()
+    await loop_monitor.stop()
+    await tracker.stop()
+    await catalog.stop()
+    await renderer.stop()
+    await transcoder.stop()
+    await storage.stop()
+    await uploader.close()
+    await ApiClient.close()
+    await sessions.close()
+    file_ids.close()
+    if jobs.leases is not None:
+        jobs.leases.close()
+
+# Регистрируем обработчики (используется и нагрузочным тестом в bench/)
+def add_handlers(app):
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
 
-    logger.info("Бот запущен!")
-    app.run_polling()
\ No newline at end of file
+def build_application(updater=True):
+    # Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+    builder = (
+        ApplicationBuilder().token(BOT_TOKEN).connect_timeout(120)
+        .rate_limiter(TelegramRateLimiter())
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup).post_shutdown(on_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    app = builder.build()
+    add_handlers(app)
+    return app
+
+# Процесс-обработчик: обновления своих чатов приходят от супервизора через очередь
+def run_worker(updates):
+    # Остановку процесса по Ctrl+C выполняет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_updates(updates))
+
+async def serve_updates(updates):
+    app = build_application(updater=False)
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+    try:
+        while True:
+            data = await asyncio.to_thread(updates.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
+
+def clear_worker_leases(pid=None):
+    """Забывает торренты завершившегося обработчика, без pid — всех обработчиков."""
+    leases = TorrentLeases()
+    try:
+        if pid is None:
+            leases.clear()
+        else:
+            leases.drop_owner(pid)
+            storage.drop_worker(pid)
+    finally:
+        leases.close()
+
+# Основной блок
+if __name__ == '__main__':
+    logger.info("Запуск бота...")
+    # Вебхук всегда принимает WebhookServer супервизора, даже с одним обработчиком:
+    # один путь приёма с проверкой секрета и размера тела и без зависимости от tornado
+    if BOT_WORKERS > 1 or BOT_MODE == "webhook":
+        # Использования торрентов прошлым запуском больше не актуальны
+        clear_worker_leases()
+        # Временные файлы прошлого запуска удаляются до старта обработчиков
+        asyncio.run(storage.cleanup_orphans())
+        asyncio.run(run_supervisor(BOT_TOKEN, run_worker, BOT_WORKERS, on_worker_exit=clear_worker_leases))
+    else:
+        app = build_application()
+        logger.info("Бот запущен!")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
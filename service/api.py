@@ -1,6 +1,13 @@
-import requests
-import urllib.parse
+import re
+import asyncio
 import logging
+import httpx
+
+from service.cache import TTLCache
+from service.search import TitleIndex, normalize_query
+from service.scheduler import api_bucket, poster_bucket
+from service.catalog import CATALOG_ENABLED, catalog
+from service.metrics import anilibria_errors, anilibria_latency
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,32 +22,191 @@ logger = logging.getLogger(__name__)
 
 API = "https://anilibria.top/api/v1"
 
+# Параметры пула соединений с API
+REQUEST_TIMEOUT = httpx.Timeout(10.0, connect=5.0)  # Таймауты на один запрос
+MAX_CONNECTIONS = 20  # Максимум открытых соединений
+MAX_KEEPALIVE_CONNECTIONS = 10  # Сколько соединений держим открытыми между запросами
+MAX_CONCURRENT_REQUESTS = 10  # Сколько запросов к API выполняется одновременно
+
+# Кэш релизов: get_title, get_torrent и download_torrent используют один ответ API
+RELEASE_CACHE_SIZE = 512
+RELEASE_CACHE_TTL = 15 * 60  # 15 минут
+
+# Кэш поиска по нормализованному запросу
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 10 * 60  # 10 минут
+# Если API не ответил за это время, пробуем ответить из локального индекса
+SEARCH_SOFT_TIMEOUT = 2.0
+
+release_cache = TTLCache("releases", maxsize=RELEASE_CACHE_SIZE, ttl=RELEASE_CACHE_TTL)
+search_cache = TTLCache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+title_index = TitleIndex()
+
+
+class Deferred(Exception):
+    """Фоновый запрос пропущен: свободных запросов к API сейчас нет."""
+
+
+async def _acquire(bucket, background):
+    # Фоновая предзагрузка не встаёт в очередь перед запросами пользователей
+    if background:
+        if not bucket.try_acquire_idle():
+            raise Deferred()
+    else:
+        await bucket.acquire()
+
+
+def _endpoint(path):
+    # Метка метрики без идентификаторов, чтобы не плодить серии
+    return re.sub(r"/\d+", "/{id}", path)
+
+
+class ApiClient:
+    """Общий асинхронный HTTP-клиент AniLibria с пулом keep-alive соединений."""
+
+    _client = None
+    _semaphore = None
+
+    @classmethod
+    def client(cls):
+        # Клиент создаётся лениво, внутри запущенного event loop
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                base_url=API,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+                ),
+                headers={"Accept": "application/json"}
+            )
+            cls._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return cls._client
+
+    @classmethod
+    async def get_json(cls, path, params=None, background=False):
+        client = cls.client()
+        await _acquire(api_bucket, background)
+        endpoint = _endpoint(path)
+        try:
+            async with cls._semaphore:
+                with anilibria_latency.time(endpoint=endpoint):
+                    response = await client.get(path, params=params)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            anilibria_errors.inc(endpoint=endpoint)
+            raise
+        return response.json()
+
+    @classmethod
+    async def get_bytes(cls, url, background=False):
+        # Абсолютный URL (постер со static-сервера) использует тот же пул соединений,
+        # но свой лимит частоты: static-сервер не делит его с API
+        client = cls.client()
+        await _acquire(poster_bucket, background)
+        try:
+            async with cls._semaphore:
+                with anilibria_latency.time(endpoint="static"):
+                    response = await client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            anilibria_errors.inc(endpoint="static")
+            raise
+        return response.content
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None and not cls._client.is_closed:
+            await cls._client.aclose()
+            logger.info("HTTP-клиент AniLibria закрыт")
+        cls._client = None
+        cls._semaphore = None
+
+
 class Anime:
+    @staticmethod
+    async def get_release(title_id, background=False):
+        # Один запрос /anime/releases/{id} на все обращения к релизу в пределах TTL.
+        # background=True — предзагрузка: при занятом API пропускается с Deferred
+        title_id = str(title_id)
+
+        async def load():
+            data = await ApiClient.get_json(f"/anime/releases/{title_id}", background=background)
+            title_index.add_release(data)
+            if CATALOG_ENABLED:
+                catalog.upsert(data)
+            return data
+
+        try:
+            return await release_cache.get_or_fetch(title_id, load)
+        except Deferred:
+            if background:
+                raise
+            # Попали на пропущенную фоновую загрузку того же релиза — загружаем сами
+            return await Anime.get_release(title_id)
+        except httpx.HTTPError:
+            # AniLibria недоступна — отвечаем из локального каталога, если там есть торренты
+            record = catalog.get(title_id) if CATALOG_ENABLED else None
+            if record is None or "torrents" not in record:
+                raise
+            logger.warning(f"API недоступен, релиз {title_id} взят из локального каталога")
+            return record
+
+    @staticmethod
+    def cache_stats():
+        return [release_cache.stats(), search_cache.stats()]
+
+    @staticmethod
+    async def _search_upstream(name):
+        # httpx сам кодирует параметры запроса
+        data = await ApiClient.get_json("/app/search/releases", params={"query": name})
+        logger.debug(f"Успешно получены данные для запроса: {name}")
+
+        # Извлекаем данные из ответа сервера
+        anime_list = []
+        for anime in data:
+            title_index.add_release(anime)
+            anime_list.append({
+                "id": anime["id"],
+                "name": anime["name"]["main"]
+            })
+        logger.debug(f"Найденные тайлы: {anime_list}")
+        return anime_list
+
     @staticmethod
     async def search(name):
-        # Кодируем строку name для корректного включения в URL
-        encoded_name = urllib.parse.quote(name)
+        query = normalize_query(name)
         logger.info(f"Выполняется поиск аниме по запросу: {name}")
+        if not query:
+            return []
 
-        try:
-            response = requests.get(f"{API}/app/search/releases?query={encoded_name}")
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Успешно получены данные для запроса: {name}")
+        # Локальный каталог отвечает без обращения к API
+        if CATALOG_ENABLED and catalog.ready:
+            anime_list = catalog.search(query)
+            if anime_list:
+                logger.info(f"Найдено {len(anime_list)} результатов в локальном каталоге для запроса: {name}")
+                return anime_list
 
-            # Извлекаем данные из ответа сервера
-            anime_list = [
-                {
-                    "id": anime["id"],
-                    "name": anime["name"]["main"]
-                } for anime in data
-            ]
-            logger.info(f"Найденные тайлы: {anime_list}")
+        # Варианты запроса, отличающиеся регистром и пробелами, делят одну запись кэша
+        task = asyncio.ensure_future(
+            search_cache.get_or_fetch(query, lambda: Anime._search_upstream(name))
+        )
+        try:
+            try:
+                anime_list = await asyncio.wait_for(asyncio.shield(task), SEARCH_SOFT_TIMEOUT)
+            except asyncio.TimeoutError:
+                local = title_index.search(query)
+                if local:
+                    # Запрос к API продолжает выполняться и заполнит кэш для следующих поисков
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    logger.warning(f"API отвечает медленно, результаты для '{name}' взяты из локального индекса")
+                    return local
+                anime_list = await task
             logger.info(f"Найдено {len(anime_list)} результатов для запроса: {name}")
             return anime_list
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при выполнении запроса поиска для '{name}': {e}")
-            return []
+            return title_index.search(query)
         except Exception as e:
             logger.error(f"Непредвиденная ошибка при обработке запроса поиска для '{name}': {e}")
             return []
@@ -50,10 +216,11 @@ class Anime:
         logger.info(f"Запрос информации об аниме с ID: {title_id}")
 
         try:
-            response = requests.get(f"{API}/anime/releases/{title_id}")
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Успешно получены данные для аниме с ID: {title_id}")
+            # Карточка релиза из локального каталога не требует запроса к API
+            data = catalog.get(title_id) if CATALOG_ENABLED else None
+            if data is None:
+                data = await Anime.get_release(title_id)
+            logger.debug(f"Успешно получены данные для аниме с ID: {title_id}")
 
             episodes = [
                 {
@@ -64,9 +231,9 @@ class Anime:
                     # "genres": data['genres']
                 }
             ]
-            logger.info(f"Успешно обработаны данные для аниме с ID: {title_id}")
+            logger.debug(f"Успешно обработаны данные для аниме с ID: {title_id}")
             return episodes
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при выполнении запроса информации для аниме с ID {title_id}: {e}")
             return []
         except Exception as e:
@@ -78,9 +245,7 @@ class Anime:
         logger.info(f"Запрос информации о торренте для аниме с ID: {title_id}")
 
         try:
-            response = requests.get(f"{API}/anime/releases/{title_id}")
-            response.raise_for_status()
-            data = response.json()
+            data = await Anime.get_release(title_id)
 
             if "torrents" not in data:
                 logger.error(f"Ошибка: ключ 'torrents' не найден в ответе API")
@@ -106,7 +271,7 @@ class Anime:
 
             return torrent_list
 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при выполнении запроса: {e}")
             return []
         except Exception as e:
@@ -118,10 +283,8 @@ class Anime:
         logger.info(f"Запрос информации о торренте с ID: {torrent_id} для аниме с ID: {title_id}")
 
         try:
-            response = requests.get(f"{API}/anime/releases/{title_id}")
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Успешно получены данные о торренте для аниме с ID: {title_id}")
+            data = await Anime.get_release(title_id)
+            logger.debug(f"Успешно получены данные о торренте для аниме с ID: {title_id}")
 
             if "torrents" not in data:
                 logger.error("Ошибка: ключ 'torrents' не найден в ответе API")
@@ -149,7 +312,7 @@ class Anime:
 
             logger.error(f"Торрент с ID {torrent_id} не найден для аниме с ID {title_id}")
             return None
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при выполнении запроса: {e}")
             return None
         except ValueError as e:
@@ -157,4 +320,4 @@ class Anime:
             return None
         except Exception as e:
             logger.error(f"Непредвиденная ошибка: {e}")
-            return None
\ No newline at end of file
+            return None
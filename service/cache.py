@@ -0,0 +1,115 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Abandoned(Exception):
+    """Задачу, выполнявшую загрузку, отменили; ожидающие загружают значение сами."""
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш в памяти с TTL и вытеснением по LRU.
+
+    Одновременные промахи по одному ключу объединяются: загрузчик
+    вызывается один раз, остальные ждут тот же результат.
+    """
+
+    def __init__(self, name, maxsize=256, ttl=600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_fetch(self, key, loader):
+        """Возвращает значение из кэша или загружает его через loader().
+
+        Ошибки загрузчика не кэшируются и передаются всем ожидающим.
+        Отмена задачи, вызвавшей загрузчик, ожидающих не отменяет:
+        один из них повторяет загрузку.
+        """
+        marker = object()
+        while True:
+            value = self.get(key, marker)
+            if value is not marker:
+                self.hits += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # Запрос уже выполняется — ждём его результат
+            try:
+                value = await asyncio.shield(inflight)
+            except _Abandoned:
+                continue
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.set_exception(_Abandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, помечаем его как полученное
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._data)
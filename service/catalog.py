@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+from service.search import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+# Локальное зеркало каталога включается переменной окружения
+CATALOG_ENABLED = os.environ.get("CATALOG_ENABLED", "0") == "1"
+CATALOG_PATH = os.path.join("cache", "catalog.json")
+# Как часто забираем изменившиеся релизы
+CATALOG_SYNC_INTERVAL = 10 * 60
+# Сколько последних обновлённых релизов проверяем за одну синхронизацию
+CATALOG_LATEST_LIMIT = 50
+CATALOG_PAGE_SIZE = 50
+
+# Поля торрента, которые нужны Anime.get_torrent и Anime.download_torrent
+_TORRENT_FIELDS = ("id", "hash", "magnet", "size")
+_TORRENT_NESTED = {"type": "description", "quality": "value", "codec": "value"}
+
+
+def _updated_at(release):
+    return release.get("updated_at") or release.get("fresh_at") or ""
+
+
+def compact_release(release):
+    """Оставляет от ответа API только то, что использует бот, в той же структуре."""
+    names = release.get("name") or {}
+    record = {
+        "id": release["id"],
+        "name": {key: names.get(key) for key in ("main", "english", "alternative") if names.get(key)},
+        "description": release.get("description") or "",
+        "poster": {"src": (release.get("poster") or {}).get("src")},
+        "updated_at": _updated_at(release),
+    }
+    if isinstance(release.get("torrents"), list):
+        record["torrents"] = [
+            {
+                **{key: torrent.get(key) for key in _TORRENT_FIELDS},
+                **{key: {field: (torrent.get(key) or {}).get(field)} for key, field in _TORRENT_NESTED.items()},
+            }
+            for torrent in release["torrents"]
+        ]
+    return record
+
+
+class ApiCatalogSource:
+    """Источник каталога: API AniLibria через переданную функцию get_json."""
+
+    def __init__(self, get_json):
+        self.get_json = get_json
+
+    async def pages(self):
+        page = 1
+        while True:
+            data = await self.get_json("/anime/catalog/releases", params={"page": page, "limit": CATALOG_PAGE_SIZE})
+            yield data.get("data") or []
+            pagination = (data.get("meta") or {}).get("pagination") or {}
+            if page >= pagination.get("total_pages", page):
+                return
+            page += 1
+
+    async def latest(self):
+        return await self.get_json("/anime/releases/latest", params={"limit": CATALOG_LATEST_LIMIT})
+
+    async def release(self, release_id):
+        return await self.get_json(f"/anime/releases/{release_id}")
+
+
+class FixtureCatalogSource:
+    """Источник каталога из записанного JSON-файла со списком релизов."""
+
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as f:
+            self.releases = json.load(f)
+        self._by_id = {release["id"]: release for release in self.releases}
+
+    async def pages(self):
+        yield self.releases
+
+    async def latest(self):
+        return self.releases
+
+    async def release(self, release_id):
+        return self._by_id[release_id]
+
+
+class Catalog:
+    """Локальное зеркало каталога AniLibria с триграммным индексом.
+
+    Записи хранятся компактно в JSON на диске и в памяти в структуре
+    ответа API, поэтому Anime может разбирать их тем же кодом.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._releases = {}  # id -> компактная запись
+        self.index = TrigramIndex()
+        self.synced_at = None
+        self._task = None
+        self._dirty = False
+
+    @property
+    def ready(self):
+        # Каталог полон только после первой полной синхронизации
+        return self.synced_at is not None
+
+    def __len__(self):
+        return len(self._releases)
+
+    def get(self, release_id):
+        try:
+            return self._releases.get(int(release_id))
+        except (TypeError, ValueError):
+            return None
+
+    def search(self, query, limit=20):
+        return self.index.search(query, limit=limit)
+
+    def upsert(self, release):
+        record = compact_release(release)
+        previous = self._releases.get(record["id"])
+        if (
+            previous is not None and "torrents" in previous and "torrents" not in record
+            and previous["updated_at"] == record["updated_at"]
+        ):
+            # Список каталога не содержит торрентов — сохраняем уже известные,
+            # если релиз с тех пор не менялся
+            record["torrents"] = previous["torrents"]
+        if record == previous:
+            return False
+        self._releases[record["id"]] = record
+        names = record["name"]
+        if names.get("main"):
+            self.index.add(record["id"], names["main"], [names.get("english"), names.get("alternative")])
+        self._dirty = True
+        return True
+
+    async def load(self):
+        try:
+            records = await asyncio.to_thread(self._read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать локальный каталог: {e}")
+            return
+        dirty = self._dirty
+        for record in records["releases"]:
+            # Релизы, полученные от API до загрузки файла, свежее сохранённых
+            if record["id"] not in self._releases:
+                self.upsert(record)
+        self.synced_at = records.get("synced_at")
+        self._dirty = dirty
+        logger.info(f"Локальный каталог загружен: {len(self)} релизов")
+
+    def _read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Каталог могут сохранять несколько процессов-обработчиков
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    async def save(self):
+        if not self._dirty:
+            return
+        data = {"synced_at": self.synced_at, "releases": list(self._releases.values())}
+        self._dirty = False
+        await asyncio.to_thread(self._write, data)
+
+    def _is_current(self, release):
+        known = self._releases.get(release["id"])
+        return known is not None and known["updated_at"] == _updated_at(release)
+
+    async def sync(self, source):
+        """Полная синхронизация для пустого или устаревшего каталога, иначе только изменившиеся релизы.
+
+        Последние обновлённые релизы идут по убыванию updated_at, поэтому
+        если среди них есть хоть один неизменившийся, то все изменения
+        с прошлой синхронизации в них попали. Если нет (бот долго
+        не работал), изменения могли уйти за CATALOG_LATEST_LIMIT.
+        """
+        changed = 0
+        latest = await source.latest() if self.ready else []
+        full = not self.ready or (latest and not any(self._is_current(release) for release in latest))
+        if full:
+            if self.ready:
+                logger.info("Локальный каталог мог устареть: полная синхронизация")
+            async for page in source.pages():
+                for release in page:
+                    changed += self.upsert(release)
+        else:
+            for release in latest:
+                known = self._releases.get(release["id"])
+                if self._is_current(release) and "torrents" in known:
+                    continue
+                # Полная карточка релиза содержит торренты
+                changed += self.upsert(await source.release(release["id"]))
+        self.synced_at = time.time()
+        await self.save()
+        logger.info(f"Синхронизация каталога завершена: изменено {changed}, всего {len(self)}")
+        return changed
+
+    def start(self, source, interval=CATALOG_SYNC_INTERVAL):
+        async def run():
+            await self.load()
+            while True:
+                try:
+                    await self.sync(source)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка синхронизации каталога: {e}")
+                await asyncio.sleep(interval)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+
+# Общий локальный каталог
+catalog = Catalog()
@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Как бот получает обновления: "polling" или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Сколько процессов-обработчиков запускать; 1 с polling — всё в одном процессе, как раньше.
+# Вебхук всегда принимает супервизор, поэтому в этом режиме процессов хотя бы два
+BOT_WORKERS = max(1, int(os.environ.get("BOT_WORKERS", "1")))
+# Сколько обновлений один процесс обрабатывает одновременно (разные чаты)
+CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "64"))
+
+# Вебхук: внешний HTTPS-адрес, который вызывает Telegram, и где его слушаем.
+# TLS обычно завершает обратный прокси перед ботом.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# Обновление Telegram занимает единицы килобайт; тело больше этого не читаем
+WEBHOOK_MAX_BODY = 1024 * 1024
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+# Номер этого процесса-обработчика и их общее число (задаёт супервизор)
+WORKER_INDEX = int(os.environ.get("BOT_WORKER_INDEX", "0"))
+WORKER_COUNT = max(1, int(os.environ.get("BOT_WORKER_COUNT", "1")))
+
+# Как часто супервизор проверяет, живы ли обработчики
+WATCH_INTERVAL = 1.0
+# Обработчик, упавший вскоре после запуска, перезапускаем с растущей паузой,
+# чтобы ошибка при старте не превращалась в бесконечный цикл перезапусков
+RESTART_DELAY = 1.0
+RESTART_MAX_DELAY = 60.0
+# Проработавший дольше этого обработчик перезапускается сразу
+RESTART_STABLE_AFTER = 60.0
+# Сколько ждём завершения обработчика при остановке
+STOP_TIMEOUT = 30
+
+
+def share(total, minimum=1):
+    """Доля общего лимита, приходящаяся на один процесс-обработчик."""
+    return max(minimum, total // WORKER_COUNT)
+
+
+def rate_share(rate):
+    """Доля общего ограничения частоты (запросов в секунду) на один процесс."""
+    return rate / WORKER_COUNT
+
+
+def webhook_url():
+    return f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+
+
+def chat_key(update):
+    """Ключ, по которому упорядочиваются обновления: чат, а без него — пользователь."""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class Supervisor:
+    """Запускает процессы-обработчики и раздаёт им обновления.
+
+    Обновления одного чата всегда попадают в один процесс в порядке
+    поступления, поэтому порядок внутри чата сохраняется, а разные чаты
+    обрабатываются на разных ядрах. Упавший обработчик перезапускается
+    с той же очередью; on_worker_exit(pid) вызывается до перезапуска.
+    Если обработчик падает сразу после запуска, пауза перед следующим
+    перезапуском удваивается до RESTART_MAX_DELAY.
+    """
+
+    def __init__(self, target, workers=BOT_WORKERS, on_worker_exit=None):
+        self.target = target
+        self.workers = workers
+        self.on_worker_exit = on_worker_exit
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._started = [0.0] * workers
+        self._delays = [0.0] * workers  # пауза перед последним перезапуском
+        self._restart_at = [None] * workers
+        self._stopping = False
+
+    def _start_process(self, index):
+        # Процесс запускается через spawn и получает копию окружения родителя
+        os.environ["BOT_WORKER_INDEX"] = str(index)
+        os.environ["BOT_WORKER_COUNT"] = str(self.workers)
+        process = self._context.Process(
+            target=self.target, args=(self._queues[index],), name=f"bot-worker-{index}"
+        )
+        process.start()
+        return process
+
+    def _spawn(self, index):
+        process = self._processes[index] = self._start_process(index)
+        self._started[index] = time.monotonic()
+        logger.info(f"Запущен обработчик {index}, pid {process.pid}")
+
+    def _restart_delay(self, index):
+        if time.monotonic() - self._started[index] >= RESTART_STABLE_AFTER:
+            return 0.0
+        return min(RESTART_MAX_DELAY, max(RESTART_DELAY, self._delays[index] * 2))
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def dispatch(self, update, data):
+        key = chat_key(update)
+        index = 0 if key is None else key % self.workers
+        self._queues[index].put(data)
+
+    async def watch(self):
+        while not self._stopping:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if self._stopping or process.is_alive():
+                    continue
+                if self._restart_at[index] is None:
+                    delay = self._delays[index] = self._restart_delay(index)
+                    self._restart_at[index] = time.monotonic() + delay
+                    logger.error(
+                        f"Обработчик {index} (pid {process.pid}) завершился с кодом {process.exitcode}, "
+                        f"перезапуск через {delay:.0f} с"
+                    )
+                    if self.on_worker_exit is not None:
+                        try:
+                            await asyncio.to_thread(self.on_worker_exit, process.pid)
+                        except Exception as e:
+                            logger.error(f"Ошибка при очистке после обработчика {index}: {e}")
+                if time.monotonic() >= self._restart_at[index]:
+                    self._restart_at[index] = None
+                    self._spawn(index)
+
+    async def stop(self):
+        self._stopping = True
+        for queue in self._queues:
+            queue.put(None)
+        for index, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Обработчик {index} не завершился за {STOP_TIMEOUT} с, принудительная остановка")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+
+
+async def poll_updates(bot, supervisor):
+    """Получение обновлений long polling'ом и передача их обработчикам."""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=30, read_timeout=40, allowed_updates=ALLOWED_UPDATES
+            )
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            supervisor.dispatch(update, update.to_dict())
+
+
+class WebhookServer:
+    """Приём обновлений от Telegram по вебхуку и передача их обработчикам.
+
+    Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token;
+    запросы без него отклоняются сразу после заголовков, не читая тело.
+    Тело больше WEBHOOK_MAX_BODY не принимается.
+    """
+
+    def __init__(self, bot, supervisor, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.bot = bot
+        self.supervisor = supervisor
+        self.path = f"/{path.strip('/')}"
+        self.secret = secret
+        self._server = None
+
+    async def start(self, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logger.info(f"Вебхук слушает {host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _check(self, method, target, headers):
+        """Статус отказа по строке запроса и заголовкам или None, если тело можно читать."""
+        if method != "POST" or target.split("?")[0] != self.path:
+            return "404 Not Found"
+        if self.secret and headers.get("x-telegram-bot-api-secret-token") != self.secret:
+            return "403 Forbidden"
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return "400 Bad Request"
+        if length < 0:
+            return "400 Bad Request"
+        if length > WEBHOOK_MAX_BODY:
+            return "413 Payload Too Large"
+        return None
+
+    def _handle(self, body):
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return "400 Bad Request"
+        self.supervisor.dispatch(update, data)
+        return "200 OK"
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), 60)
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), 10)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                status = self._check(method, target, headers)
+                if status is not None:
+                    # Тело не прочитано, поэтому соединение дальше использовать нельзя
+                    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+                    await writer.drain()
+                    return
+                body = await asyncio.wait_for(reader.readexactly(int(headers.get("content-length", 0))), 10)
+                status = self._handle(body)
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run_supervisor(token, target, workers=BOT_WORKERS, on_worker_exit=None):
+    """Супервизор: один процесс принимает обновления, workers процессов их обрабатывают."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    supervisor = Supervisor(target, workers, on_worker_exit)
+    supervisor.start()
+    server = None
+    async with Bot(token) as bot:
+        tasks = [asyncio.create_task(stop.wait()), asyncio.create_task(supervisor.watch())]
+        if BOT_MODE == "webhook":
+            server = WebhookServer(bot, supervisor)
+            await server.start()
+            await bot.set_webhook(
+                url=webhook_url(), secret_token=WEBHOOK_SECRET or None, allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            await bot.delete_webhook()
+            tasks.append(asyncio.create_task(poll_updates(bot, supervisor)))
+        logger.info(f"Супервизор запущен: режим {BOT_MODE}, обработчиков {workers}")
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.error(f"Супервизор остановлен из-за ошибки: {task.exception()}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if server is not None:
+                await server.stop()
+            await supervisor.stop()
+            logger.info("Супервизор остановлен")
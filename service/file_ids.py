@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FILE_IDS_DB = os.path.join("cache", "file_ids.sqlite3")
+
+
+class FileIdIndex:
+    """Постоянное хранилище file_id, полученных от Telegram после загрузки.
+
+    Повторная отправка по file_id не передаёт файл заново. Кроме
+    отдельных файлов хранится состав торрента, чтобы повторный запрос
+    целого торрента обслуживался только по file_id.
+    """
+
+    def __init__(self, path=FILE_IDS_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS torrents ("
+                "key TEXT PRIMARY KEY, files TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(sql, params)
+                return cursor.fetchone() if fetch else None
+
+    async def get(self, key):
+        row = await asyncio.to_thread(self._execute, "SELECT file_id FROM file_ids WHERE key = ?", (key,), True)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    async def put(self, key, file_id):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO file_ids (key, file_id, created) VALUES (?, ?, ?)",
+            (key, file_id, time.time())
+        )
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._execute, "DELETE FROM file_ids WHERE key = ?", (key,))
+
+    async def get_torrent(self, key):
+        """Состав торрента: [(имя файла, число частей)] или None."""
+        row = await asyncio.to_thread(self._execute, "SELECT files FROM torrents WHERE key = ?", (key,), True)
+        return [tuple(item) for item in json.loads(row[0])] if row else None
+
+    async def put_torrent(self, key, files):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO torrents (key, files, created) VALUES (?, ?, ?)",
+            (key, json.dumps(files, ensure_ascii=False), time.time())
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": "file_ids",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Общий индекс file_id
+file_ids = FileIdIndex()
@@ -0,0 +1,336 @@
+import os
+import asyncio
+import sqlite3
+import logging
+import threading
+
+from service.cluster import WORKER_COUNT
+from service.qbit import qb
+
+logger = logging.getLogger(__name__)
+
+# Общий для процессов-обработчиков учёт того, кому ещё нужен торрент
+LEASES_DB = os.path.join("cache", "jobs.sqlite3")
+# Как часто процесс проверяет, закончил ли загрузку её владелец в другом процессе
+OWNER_POLL_INTERVAL = 2.0
+
+
+class _Subscriber:
+    def __init__(self, on_status, on_episode):
+        self.on_status = on_status
+        self.on_episode = on_episode
+        self.queue = asyncio.Queue()
+
+
+class DownloadJob:
+    """Одна загрузка торрента, результаты которой получают все подписчики.
+
+    Серии сохраняются в истории, поэтому подписчик, пришедший позже,
+    получает и уже отправленные другим серии.
+    """
+
+    def __init__(self, magnet_hash):
+        self.magnet_hash = magnet_hash
+        self.subscribers = []
+        self.episodes = []
+        self.status = None
+        self.results = None
+        self.finished = False
+        self.task = None
+
+    async def publish_status(self, text, final=False):
+        self.status = (text, final)
+        for subscriber in list(self.subscribers):
+            try:
+                await subscriber.on_status(text, final)
+            except Exception as e:
+                logger.warning(f"Ошибка при обновлении статуса загрузки {self.magnet_hash}: {e}")
+
+    def publish_episode(self, file_name, file_path, parts):
+        episode = (file_name, file_path, parts)
+        self.episodes.append(episode)
+        for subscriber in self.subscribers:
+            subscriber.queue.put_nowait(episode)
+
+    def _finish(self, results):
+        self.results = results
+        self.finished = True
+        for subscriber in self.subscribers:
+            subscriber.queue.put_nowait(None)
+
+
+class TorrentLeases:
+    """Какие процессы-обработчики сейчас используют торрент и кто его загружает.
+
+    Реестр загрузок живёт в памяти процесса, а qBittorrent общий: торрент
+    удаляется, только когда его отпустил последний процесс. Загружает и
+    сжимает торрент один процесс — владелец (таблица torrent_owners,
+    состояние running/done/failed), остальные ждут его результатов.
+    """
+
+    def __init__(self, path=LEASES_DB, owner=None):
+        self.path = path
+        self.owner = owner if owner is not None else os.getpid()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS torrent_leases ("
+                "hash TEXT NOT NULL, owner INTEGER NOT NULL, PRIMARY KEY (hash, owner))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS torrent_owners ("
+                "hash TEXT PRIMARY KEY, owner INTEGER NOT NULL, state TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(query, args).fetchall()
+
+    def _release(self, magnet_hash):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM torrent_leases WHERE hash = ? AND owner = ?", (magnet_hash, self.owner))
+                (remaining,) = conn.execute(
+                    "SELECT COUNT(*) FROM torrent_leases WHERE hash = ?", (magnet_hash,)
+                ).fetchone()
+                if remaining == 0:
+                    conn.execute("DELETE FROM torrent_owners WHERE hash = ?", (magnet_hash,))
+        return remaining == 0
+
+    def _claim(self, magnet_hash):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO torrent_owners (hash, owner, state) VALUES (?, ?, 'running')",
+                    (magnet_hash, self.owner)
+                )
+                (owner,) = conn.execute(
+                    "SELECT owner FROM torrent_owners WHERE hash = ?", (magnet_hash,)
+                ).fetchone()
+        return owner == self.owner
+
+    async def acquire(self, magnet_hash):
+        await asyncio.to_thread(
+            self._execute, "INSERT OR IGNORE INTO torrent_leases (hash, owner) VALUES (?, ?)", (magnet_hash, self.owner)
+        )
+
+    async def release(self, magnet_hash):
+        """Отпускает торрент; True, если он больше никому не нужен."""
+        return await asyncio.to_thread(self._release, magnet_hash)
+
+    async def claim(self, magnet_hash):
+        """Становится владельцем загрузки; False, если её уже ведёт другой процесс."""
+        return await asyncio.to_thread(self._claim, magnet_hash)
+
+    async def finish(self, magnet_hash, ok):
+        """Отмечает загрузку этого процесса завершённой: ожидающие берут результат."""
+        await asyncio.to_thread(
+            self._execute, "UPDATE torrent_owners SET state = ? WHERE hash = ? AND owner = ?",
+            ("done" if ok else "failed", magnet_hash, self.owner)
+        )
+
+    async def disown(self, magnet_hash):
+        """Отказывается от прерванной загрузки, чтобы её продолжил другой процесс."""
+        await asyncio.to_thread(
+            self._execute, "DELETE FROM torrent_owners WHERE hash = ? AND owner = ? AND state = 'running'",
+            (magnet_hash, self.owner)
+        )
+
+    async def owner_state(self, magnet_hash):
+        """Состояние загрузки у владельца или None, если владельца нет."""
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT state FROM torrent_owners WHERE hash = ?", (magnet_hash,)
+        )
+        return rows[0][0] if rows else None
+
+    async def holders(self, magnet_hash):
+        """Сколько процессов сейчас используют торрент."""
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT COUNT(*) FROM torrent_leases WHERE hash = ?", (magnet_hash,)
+        )
+        return rows[0][0]
+
+    def drop_owner(self, owner):
+        """Забывает торренты завершившегося процесса (вызывает супервизор).
+
+        Его незавершённые загрузки освобождаются: их подхватят ожидающие процессы.
+        """
+        self._execute("DELETE FROM torrent_leases WHERE owner = ?", (owner,))
+        self._execute("DELETE FROM torrent_owners WHERE owner = ? AND state = 'running'", (owner,))
+
+    def clear(self):
+        self._execute("DELETE FROM torrent_leases")
+        self._execute("DELETE FROM torrent_owners")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobRegistry:
+    """Реестр загрузок по хэшу торрента.
+
+    Повторный запрос того же торрента подключается к уже идущей загрузке,
+    а не добавляет её в qBittorrent ещё раз. on_release(hash) вызывается
+    один раз, когда загрузка завершена и все подписчики получили файлы.
+    С leases (TorrentLeases) — только если торрент не нужен и другим
+    процессам-обработчикам. Тогда же загрузку одного торрента ведёт
+    только один процесс: остальные ждут, пока владелец закончит, и
+    получают серии через follower(job) (например, из кэша сжатых файлов).
+    Если владелец завершился аварийно, загрузку забирает ожидающий.
+    """
+
+    def __init__(self, on_release=None, leases=None):
+        self.on_release = on_release
+        self.leases = leases
+        self._jobs = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    async def in_use(self, magnet_hash):
+        """True, если торрент качается или раздаётся в этом или другом процессе."""
+        magnet_hash = magnet_hash.lower()
+        if magnet_hash in self._jobs:
+            return True
+        return self.leases is not None and await self.leases.holders(magnet_hash) > 0
+
+    async def run(self, magnet_hash, runner, on_status, on_episode, follower=None, on_wait=None):
+        """Подписывается на загрузку magnet_hash, запуская runner(job), если её ещё нет.
+
+        on_episode вызывается для каждой серии в порядке публикации.
+        Если торрент загружает другой процесс, вместо runner после его
+        завершения вызывается follower(job), а пока он идёт — on_wait(job)
+        раз в OWNER_POLL_INTERVAL. follower возвращает результаты или None,
+        если взять их неоткуда; тогда загрузка выполняется заново.
+        Возвращает результат runner или None при ошибке.
+        """
+        magnet_hash = magnet_hash.lower()
+        subscriber = _Subscriber(on_status, on_episode)
+        job = self._jobs.get(magnet_hash)
+        if job is None:
+            job = self._jobs[magnet_hash] = DownloadJob(magnet_hash)
+            job.subscribers.append(subscriber)
+            if self.leases is not None:
+                try:
+                    await self.leases.acquire(magnet_hash)
+                except sqlite3.Error as e:
+                    logger.error(f"Не удалось записать использование торрента {magnet_hash}: {e}")
+            job.task = asyncio.create_task(self._drive(job, runner, follower, on_wait))
+        else:
+            logger.info(f"Запрос подключён к уже идущей загрузке {magnet_hash}, подписчиков: {len(job.subscribers) + 1}")
+            for episode in job.episodes:
+                subscriber.queue.put_nowait(episode)
+            if job.finished:
+                subscriber.queue.put_nowait(None)
+            job.subscribers.append(subscriber)
+            if job.status is not None and not job.finished:
+                await on_status(*job.status)
+
+        try:
+            while True:
+                episode = await subscriber.queue.get()
+                if episode is None:
+                    break
+                await on_episode(*episode)
+            return job.results
+        finally:
+            job.subscribers.remove(subscriber)
+            await self._maybe_release(job)
+
+    async def _drive(self, job, runner, follower=None, on_wait=None):
+        results = None
+        try:
+            if self.leases is None or follower is None:
+                results = await runner(job)
+            else:
+                results = await self._run_shared(job, runner, follower, on_wait)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки {job.magnet_hash}: {e}")
+        finally:
+            job._finish(results)
+            await self._maybe_release(job)
+
+    async def _run_shared(self, job, runner, follower, on_wait):
+        magnet_hash = job.magnet_hash
+        while True:
+            if await self.leases.claim(magnet_hash):
+                try:
+                    results = await runner(job)
+                except asyncio.CancelledError:
+                    await self.leases.disown(magnet_hash)
+                    raise
+                except Exception:
+                    await self.leases.finish(magnet_hash, False)
+                    raise
+                await self.leases.finish(magnet_hash, results is not None)
+                return results
+
+            logger.info(f"Торрент {magnet_hash} загружает другой обработчик, ждём его результатов")
+            state = await self._wait_owner(job, on_wait)
+            if state is None:
+                # Владелец завершился, не закончив загрузку: пробуем забрать её
+                continue
+            if state == "failed":
+                return None
+            results = await follower(job)
+            if results is not None:
+                return results
+            logger.info(f"Результатов загрузки {magnet_hash} нет в кэше, загружаем заново")
+            return await runner(job)
+
+    async def _wait_owner(self, job, on_wait):
+        while True:
+            state = await self.leases.owner_state(job.magnet_hash)
+            if state != "running":
+                return state
+            if on_wait is not None:
+                try:
+                    await on_wait(job)
+                except Exception as e:
+                    logger.warning(f"Ошибка при ожидании загрузки {job.magnet_hash}: {e}")
+            await asyncio.sleep(OWNER_POLL_INTERVAL)
+
+    async def _maybe_release(self, job):
+        # Удаляем только когда загрузка закончилась и последний подписчик обслужен
+        if job.subscribers or not job.finished or self._jobs.get(job.magnet_hash) is not job:
+            return
+        del self._jobs[job.magnet_hash]
+        if self.on_release is not None:
+            try:
+                if self.leases is not None and not await self.leases.release(job.magnet_hash):
+                    logger.info(f"Торрент {job.magnet_hash} ещё нужен другим обработчикам")
+                    return
+                await self.on_release(job.magnet_hash)
+            except Exception as e:
+                logger.error(f"Ошибка при освобождении загрузки {job.magnet_hash}: {e}")
+
+    def stats(self):
+        return {
+            "jobs": len(self._jobs),
+            "subscribers": sum(len(job.subscribers) for job in self._jobs.values()),
+        }
+
+
+async def _delete_torrent(magnet_hash):
+    await qb.delete([magnet_hash], delete_files=True)
+    logger.info(f"Торрент {magnet_hash} удален после отправки файлов всем подписчикам.")
+
+
+# Общий реестр загрузок; между процессами-обработчиками торренты делятся через TorrentLeases
+jobs = JobRegistry(on_release=_delete_torrent, leases=TorrentLeases() if WORKER_COUNT > 1 else None)
@@ -0,0 +1,272 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Адрес HTTP-эндпоинта /metrics; METRICS_PORT=0 — эндпоинт выключен.
+# У каждого процесса-обработчика свои метрики: обработчик N слушает METRICS_PORT + N
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Как часто проверяем задержку event loop
+LOOP_LAG_INTERVAL = 0.5
+# Задержка больше этой считается блокировкой и попадает в лог
+LOOP_LAG_WARNING = 0.1
+# Повторяющиеся сообщения пишем в лог не чаще, чем раз в столько секунд
+LOG_SAMPLE_INTERVAL = 30.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+THROUGHPUT_BUCKETS = tuple(2 ** power * 1024 for power in range(6, 17, 2))  # 64KB/s .. 64MB/s
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}  # кортеж меток -> значение
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus."""
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # кортеж меток -> [счётчики корзин..., сумма, количество]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока, в том числе завершившегося исключением."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            counts = series[:-2]
+            # Значения больше последней границы попадают только в +Inf
+            overflow = series[-1] - sum(counts)
+            cumulative = 0
+            for bound, amount in zip(self.buckets + (float("inf"),), counts + [overflow]):
+                cumulative += amount
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(labels)} {series[-1]}"
+
+
+class StatsGauges:
+    """Gauge-метрики из словарей stats(), которые уже есть у кэшей и очередей.
+
+    fn возвращает словарь или список словарей; каждое числовое поле
+    становится метрикой {prefix}_{поле}, а поле "name" — меткой.
+    """
+
+    def __init__(self, prefix, fn):
+        self.prefix = prefix
+        self.fn = fn
+
+    def render(self):
+        try:
+            stats = self.fn()
+        except Exception as e:
+            logger.warning(f"Не удалось собрать метрики {self.prefix}: {e}")
+            return
+        # Строки одной метрики в формате Prometheus должны идти подряд
+        samples = {}
+        for entry in stats if isinstance(stats, list) else [stats]:
+            labels = (("name", entry["name"]),) if "name" in entry else ()
+            for field, value in entry.items():
+                if field == "name" or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                samples.setdefault(f"{self.prefix}_{field}", []).append((labels, value))
+        for name, values in samples.items():
+            yield f"# TYPE {name} gauge"
+            for labels, value in values:
+                yield f"{name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation):
+        metric = Counter(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def stats(self, prefix, fn):
+        self._metrics.append(StatsGauges(prefix, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Замеряет, насколько позже запланированного просыпается event loop.
+
+    Большая задержка означает, что какой-то обработчик выполнял
+    блокирующий код (синхронный ввод-вывод, тяжёлые вычисления).
+    """
+
+    def __init__(self, histogram, blocked, interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_WARNING):
+        self.histogram = histogram
+        self.blocked = blocked
+        self.interval = interval
+        self.threshold = threshold
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.histogram.observe(lag)
+            if lag > self.threshold:
+                self.blocked.inc(lag)
+                if sampled("loop_lag"):
+                    logger.warning(f"Event loop был заблокирован на {lag * 1000:.0f} мс", extra={"lag": lag})
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в текстовом формате Prometheus."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._server = None
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+_last_logged = {}
+
+
+def sampled(key, interval=LOG_SAMPLE_INTERVAL):
+    """True не чаще раза в interval секунд для одного key — для прореживания логов."""
+    now = time.monotonic()
+    if now - _last_logged.get(key, float("-inf")) < interval:
+        return False
+    _last_logged[key] = now
+    if len(_last_logged) > 10000:
+        # Ключи завершённых загрузок больше не нужны
+        for old_key in [k for k, at in _last_logged.items() if now - at >= interval]:
+            del _last_logged[old_key]
+    return True
+
+
+# Общий реестр метрик и метрики горячих путей
+registry = MetricsRegistry()
+anilibria_latency = registry.histogram("anilibria_request_seconds", "Длительность запросов к API AniLibria")
+anilibria_errors = registry.counter("anilibria_errors_total", "Неудачные запросы к API AniLibria")
+qbit_latency = registry.histogram("qbittorrent_call_seconds", "Длительность вызовов qBittorrent")
+qbit_errors = registry.counter("qbittorrent_errors_total", "Неудачные вызовы qBittorrent")
+ffmpeg_duration = registry.histogram("ffmpeg_job_seconds", "Длительность сжатия одной серии", DURATION_BUCKETS)
+telegram_upload_seconds = registry.histogram(
+    "telegram_upload_seconds", "Длительность загрузки файла в Telegram", DURATION_BUCKETS
+)
+telegram_upload_throughput = registry.histogram(
+    "telegram_upload_bytes_per_second", "Скорость загрузки файлов в Telegram", THROUGHPUT_BUCKETS
+)
+telegram_upload_bytes = registry.counter("telegram_upload_bytes_total", "Байт загружено в Telegram")
+loop_lag = registry.histogram("event_loop_lag_seconds", "Задержка пробуждения event loop")
+loop_blocked = registry.counter("event_loop_blocked_seconds_total", "Суммарное время блокировок event loop")
+loop_monitor = LoopLagMonitor(loop_lag, loop_blocked)
+metrics_server = MetricsServer(registry)
@@ -0,0 +1,141 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+from service.qbit import qb, tracker
+from service.scheduler import transcodes
+from service.storage import storage
+from service.tracker import is_complete
+from service.transcoder import MAX_UPLOAD_SIZE, TranscodeError, transcoder
+from service.transcode_cache import transcode_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def compress_video(job, max_size=MAX_UPLOAD_SIZE):
+    try:
+        output_paths = await job.wait()
+    except TranscodeError as e:
+        logger.error(f"Ошибка сжатия {job.input_path}: {e}")
+        return None
+    except asyncio.CancelledError:
+        if not job.cancelled:
+            # Отменили ожидающую задачу, а не сжатие: отмена должна дойти до вызывающего
+            raise
+        logger.info(f"Сжатие {job.input_path} отменено")
+        return None
+
+    if any(os.path.getsize(path) > max_size for path in output_paths):
+        logger.warning("Файл все еще больше 50MB, попробуйте уменьшить битрейт.")
+        return None
+    return output_paths
+
+
+class TorrentPipeline:
+    """Конвейер загрузка → сжатие → отправка для одного торрента.
+
+    Торрент качается последовательно, и каждая серия уходит на сжатие,
+    как только скачан именно её файл. Отправка серии N идёт параллельно
+    со сжатием серии N+1 и загрузкой остальных; пользователю серии
+    приходят по порядку имён файлов.
+
+    user_id — владелец задачи для распределения очереди сжатия между
+    пользователями. on_progress(torrent) вызывается на каждый снимок состояния торрента,
+    on_episode(file_name, file_path, parts) — для каждой готовой серии
+    (parts равен None, если сжать не удалось).
+    """
+
+    def __init__(self, magnet_hash, profile, user_id=None, on_progress=None, on_episode=None, max_size=MAX_UPLOAD_SIZE):
+        self.magnet_hash = magnet_hash
+        self.user_id = user_id
+        self.profile = profile
+        self.on_progress = on_progress
+        self.on_episode = on_episode
+        self.max_size = max_size
+        self.torrent = None
+        self._order = None
+        self._ready = {}  # имя файла -> Future с (путь, части)
+        self._started = set()
+        self._tasks = []
+        self._jobs = []
+        self._uploader = None
+        self.results = []
+
+    async def run(self):
+        """Возвращает [(имя файла, части)] или None, если торрент не скачался."""
+        try:
+            async for torrent in tracker.track(self.magnet_hash):
+                self.torrent = torrent
+                if self.on_progress is not None:
+                    await self.on_progress(torrent)
+                await self._check_files(final=False)
+
+            if self.torrent is None or not is_complete(self.torrent):
+                return None
+
+            # Запускаем серии, завершение которых пришлось на последний снимок
+            await self._check_files(final=True)
+            if self._uploader is not None:
+                await self._uploader
+            return self.results
+        finally:
+            self._cancel()
+
+    async def _check_files(self, final):
+        files = await qb.files(self.magnet_hash)
+        if not files:
+            # Метаданные магнит-ссылки ещё не получены
+            return
+        if self._order is None:
+            loop = asyncio.get_running_loop()
+            self._order = sorted(file.name for file in files)
+            self._ready = {name: loop.create_future() for name in self._order}
+            self._uploader = asyncio.create_task(self._upload())
+
+        save_path = self.torrent.get("save_path", "")
+        for file in files:
+            if file.name in self._started or (file.progress < 1 and not final):
+                continue
+            self._started.add(file.name)
+            logger.info(f"Серия {file.name} скачана, запускаем сжатие")
+            file_path = os.path.join(save_path, file.name)
+            self._tasks.append(asyncio.create_task(self._process(file.name, file_path)))
+
+    async def _process(self, file_name, file_path):
+        future = self._ready[file_name]
+        try:
+            parts = await transcode_cache.get(self.magnet_hash, file_name, self.profile)
+            if parts is None:
+                # Результат ffmpeg пишется в каталог загрузки, а не рядом с оригиналом:
+                # неудачные попытки удаляются вместе с ним в storage.finish_work
+                name = hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:16]
+                compressed_path = os.path.join(storage.work_dir(self.magnet_hash), f"{name}.mp4")
+                async with transcodes.slot(self.user_id):
+                    logger.info(f"Сжимаем видео: {file_name}")
+                    job = transcoder.submit(file_path, compressed_path, max_size=self.max_size)
+                    self._jobs.append(job)
+                    parts = await compress_video(job, self.max_size)
+                if parts:
+                    parts = await transcode_cache.put(self.magnet_hash, file_name, self.profile, parts)
+        except Exception as e:
+            logger.error(f"Ошибка обработки серии {file_name}: {e}")
+            parts = None
+        if not future.done():
+            future.set_result((file_path, parts))
+
+    async def _upload(self):
+        for file_name in self._order:
+            file_path, parts = await self._ready[file_name]
+            if self.on_episode is not None:
+                await self.on_episode(file_name, file_path, parts)
+            self.results.append((file_name, parts))
+
+    def _cancel(self):
+        for job in self._jobs:
+            job.cancel()
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+        if self._uploader is not None and not self._uploader.done():
+            self._uploader.cancel()
@@ -0,0 +1,128 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+from service.api import Anime, ApiClient, Deferred
+from service.cache import TTLCache
+from service.file_ids import file_ids
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow необязателен: без него постеры кэшируются как есть
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+POSTER_BASE_URL = "https://static-libria.weekstorm.one"
+POSTER_DIR = os.path.join("cache", "posters")
+# Размер, удобный для Telegram: крупнее всё равно будет пережато на стороне сервера
+POSTER_MAX_SIDE = 1280
+POSTER_JPEG_QUALITY = 85
+# Сколько постеров из результатов поиска загружаем заранее
+PREFETCH_COUNT = 5
+
+
+def _resize(data, path):
+    tmp_path = f"{path}.tmp"
+    if Image is None:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    else:
+        from io import BytesIO
+        with Image.open(BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((POSTER_MAX_SIDE, POSTER_MAX_SIDE))
+            image.save(tmp_path, "JPEG", quality=POSTER_JPEG_QUALITY, optimize=True)
+    os.replace(tmp_path, path)
+
+
+class PosterService:
+    """Постеры релизов: асинхронная загрузка, дисковый кэш и file_id Telegram.
+
+    После первой отправки постер пересылается по file_id, без передачи
+    изображения. Одновременные запросы одного постера объединяются.
+    """
+
+    def __init__(self, root=POSTER_DIR):
+        self.root = root
+        if Image is None:
+            logger.warning("Pillow не установлен: постеры кэшируются без уменьшения, как их отдаёт сервер")
+        # Запоминаем уже проверенные локальные файлы, чтобы не обращаться к диску
+        self._local = TTLCache("posters", maxsize=2048, ttl=24 * 60 * 60)
+
+    def _path(self, poster):
+        name = hashlib.sha1(poster.encode("utf-8")).hexdigest()
+        # Без Pillow байты не перекодируются и формат файла заранее неизвестен
+        ext = ".jpg" if Image is not None else ".img"
+        return os.path.join(self.root, name[:2], f"{name}{ext}")
+
+    @staticmethod
+    def _file_id_key(poster):
+        return f"poster:{poster}"
+
+    async def get_file(self, poster, background=False):
+        """Путь к закэшированному на диске постеру; загружает его при промахе.
+
+        background=True — предзагрузка: при занятом static-сервере пропускается с Deferred.
+        """
+        path = self._path(poster)
+
+        async def load():
+            if await asyncio.to_thread(os.path.exists, path):
+                return path
+            data = await ApiClient.get_bytes(f"{POSTER_BASE_URL}{poster}", background=background)
+            await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+            await asyncio.to_thread(_resize, data, path)
+            logger.info(f"Постер {poster} сохранён в кэш")
+            return path
+
+        try:
+            return await self._local.get_or_fetch(poster, load)
+        except Deferred:
+            if background:
+                raise
+            # Попали на пропущенную предзагрузку того же постера — загружаем сами
+            return await self.get_file(poster)
+
+    async def get(self, poster):
+        """file_id постера, если он уже отправлялся, иначе путь к файлу на диске."""
+        file_id = await file_ids.get(self._file_id_key(poster))
+        if file_id:
+            return file_id
+        return await self.get_file(poster)
+
+    async def remember(self, poster, message):
+        # edit_message_media для inline-сообщений возвращает True вместо Message
+        if message is True or not getattr(message, "photo", None):
+            return
+        await file_ids.put(self._file_id_key(poster), message.photo[-1].file_id)
+
+    async def forget(self, poster):
+        await file_ids.delete(self._file_id_key(poster))
+
+    def stats(self):
+        return self._local.stats()
+
+    async def prefetch_titles(self, title_ids):
+        """Заранее загружает релизы и постеры, пока пользователь читает список.
+
+        Предзагрузка идёт с низким приоритетом: если лимит запросов занят
+        запросами пользователей, она просто пропускается.
+        """
+        async def prefetch(title_id):
+            try:
+                release = await Anime.get_release(title_id, background=True)
+                poster = release["poster"]["src"]
+                if not await file_ids.get(self._file_id_key(poster)):
+                    await self.get_file(poster, background=True)
+            except Deferred:
+                logger.debug(f"Предзагрузка {title_id} пропущена: лимит запросов занят")
+            except Exception as e:
+                logger.debug(f"Не удалось заранее загрузить постер для {title_id}: {e}")
+
+        await asyncio.gather(*(prefetch(title_id) for title_id in title_ids[:PREFETCH_COUNT]))
+
+
+# Общий сервис постеров
+posters = PosterService()
@@ -0,0 +1,185 @@
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from service.cluster import rate_share
+from service.scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Доля общего бюджета Bot API, которую могут занимать правки прогресса
+PROGRESS_EDITS_RPS = rate_share(8)
+# Одно сообщение правим не чаще, чем раз в столько секунд
+MIN_EDIT_INTERVAL = 3.0
+# И не реже — даже когда активных сообщений очень много
+MAX_EDIT_INTERVAL = 60.0
+
+
+class _Progress:
+    def __init__(self, message):
+        self.message = message
+        self.text = None  # последний желаемый текст
+        self.sent_text = None  # последний отправленный текст
+        self.next_edit = 0.0
+        self.sending = False
+
+
+class ProgressRenderer:
+    """Объединённые правки сообщений с прогрессом.
+
+    Для каждого сообщения хранится только последний текст; правка
+    не отправляется, если текст не изменился. Частота правок одного
+    сообщения подстраивается под число активных сообщений так, чтобы
+    все вместе они не превышали PROGRESS_EDITS_RPS. При 429 все правки
+    приостанавливаются на retry_after.
+    """
+
+    def __init__(self, edits_rps=PROGRESS_EDITS_RPS):
+        self.edits_rps = edits_rps
+        self.bucket = TokenBucket(edits_rps)
+        self._messages = {}  # (chat_id, message_id) -> _Progress
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._task = None
+        self._sending = set()  # задачи правок в пути, чтобы их не собрал сборщик мусора
+        self.skipped = 0
+        self.sent = 0
+
+    @staticmethod
+    def _key(message):
+        return message.chat_id, message.message_id
+
+    @property
+    def interval(self):
+        active = max(1, len(self._messages))
+        return min(MAX_EDIT_INTERVAL, max(MIN_EDIT_INTERVAL, active / self.edits_rps))
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def update(self, message, text):
+        """Запоминает новый текст; правка будет отправлена, когда позволит бюджет."""
+        progress = self._messages.get(self._key(message))
+        if progress is None:
+            progress = self._messages[self._key(message)] = _Progress(message)
+        if text == progress.text:
+            self.skipped += 1
+            return
+        progress.text = text
+        self._ensure_running()
+        self._wakeup.set()
+
+    async def finish(self, message, text):
+        """Отправляет итоговый текст сразу и перестаёт отслеживать сообщение."""
+        progress = self._messages.pop(self._key(message), None)
+        if progress is not None:
+            # Дожидаемся правки, которая уже в пути, чтобы она не затёрла итоговый текст
+            while progress.sending:
+                await asyncio.sleep(0.05)
+            if progress.sent_text == text:
+                return
+        for _ in range(3):
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if await self._edit(message, text) or self._paused_until <= time.monotonic():
+                return
+
+    def forget(self, message):
+        self._messages.pop(self._key(message), None)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._sending):
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            due = [
+                p for p in self._messages.values()
+                if p.text != p.sent_text and not p.sending and p.next_edit <= now
+            ]
+            if not due:
+                waiting = [p.next_edit for p in self._messages.values() if p.text != p.sent_text and not p.sending]
+                self._wakeup.clear()
+                timeout = max(0.0, min(waiting) - now) if waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Сначала те, кто дольше всех ждёт
+            due.sort(key=lambda p: p.next_edit)
+            for progress in due:
+                await self.bucket.acquire()
+                if time.monotonic() < self._paused_until:
+                    break
+                progress.sending = True
+                task = asyncio.create_task(self._send(progress))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+
+    async def _send(self, progress):
+        text = progress.text
+        if self._messages.get(self._key(progress.message)) is not progress:
+            # Сообщение уже завершено через finish()
+            progress.sending = False
+            return
+        try:
+            if await self._edit(progress.message, text):
+                progress.sent_text = text
+        finally:
+            progress.sending = False
+            progress.next_edit = time.monotonic() + self.interval
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _edit(self, message, text):
+        """True, если повторять правку не нужно; False при 429."""
+        try:
+            await message.edit_text(text)
+            self.sent += 1
+            return True
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logger.warning(f"Превышен лимит Telegram, правки прогресса приостановлены на {retry_after} с")
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            return False
+        except BadRequest as e:
+            # Текст не изменился или сообщение удалено — повторять бессмысленно
+            logger.debug(f"Правка прогресса не выполнена: {e}")
+            return True
+        except TelegramError as e:
+            # Сеть, таймаут или бот заблокирован: следующая правка придёт со следующим прогрессом
+            logger.warning(f"Правка прогресса не выполнена: {e}")
+            return True
+
+    def stats(self):
+        return {
+            "active": len(self._messages),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "interval": self.interval,
+        }
+
+
+# Общий обработчик сообщений с прогрессом
+renderer = ProgressRenderer()
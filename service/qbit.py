@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import qbittorrentapi
+
+from service.metrics import qbit_errors, qbit_latency
+from service.tracker import DownloadTracker
+
+logger = logging.getLogger(__name__)
+
+QB_HOST = "localhost"
+QB_PORT = 8080
+QB_USERNAME = "admin"
+QB_PASSWORD = "adminadmin"
+
+# Сколько вызовов qBittorrent выполняется параллельно в потоках
+MAX_PARALLEL_CALLS = 4
+# Окно, за которое одновременные запросы статуса собираются в один torrents_info
+BATCH_WINDOW = 0.05
+
+
+class QBitGateway:
+    """Единая точка доступа к qBittorrent.
+
+    Все вызовы выполняются вне event loop и используют одну
+    авторизованную сессию. При истечении сессии выполняется повторный
+    вход и вызов повторяется один раз. Запросы статуса по отдельным
+    хэшам, пришедшие одновременно, объединяются в один torrents_info.
+    """
+
+    def __init__(self, host=QB_HOST, port=QB_PORT, username=QB_USERNAME, password=QB_PASSWORD):
+        self.client = qbittorrentapi.Client(
+            host=host,
+            port=port,
+            username=username,
+            password=password
+        )
+        self._semaphore = None
+        self._login_lock = None
+        self._pending = {}  # hash -> [asyncio.Future]
+        self._flush_handle = None
+
+    def _ensure_primitives(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(MAX_PARALLEL_CALLS)
+            self._login_lock = asyncio.Lock()
+
+    async def login(self):
+        self._ensure_primitives()
+        async with self._login_lock:
+            await asyncio.to_thread(self.client.auth_log_in)
+        logger.info("Подключено к qBittorrent")
+
+    async def call(self, method, *args, **kwargs):
+        self._ensure_primitives()
+        func = getattr(self.client, method)
+        async with self._semaphore:
+            try:
+                try:
+                    with qbit_latency.time(method=method):
+                        return await asyncio.to_thread(func, *args, **kwargs)
+                except (qbittorrentapi.Forbidden403Error, qbittorrentapi.Unauthorized401Error):
+                    logger.warning(f"Сессия qBittorrent истекла при вызове {method}, повторный вход")
+                    await self.login()
+                    with qbit_latency.time(method=method):
+                        return await asyncio.to_thread(func, *args, **kwargs)
+            except Exception:
+                qbit_errors.inc(method=method)
+                raise
+
+    async def add(self, magnet, **options):
+        return await self.call("torrents_add", urls=magnet, **options)
+
+    async def files(self, magnet_hash):
+        return await self.call("torrents_files", torrent_hash=magnet_hash)
+
+    async def delete(self, hashes, delete_files=False):
+        return await self.call("torrents_delete", delete_files=delete_files, torrent_hashes=hashes)
+
+    async def maindata(self, rid=0):
+        return await self.call("sync_maindata", rid=rid)
+
+    async def info(self, magnet_hash):
+        """Возвращает информацию о торренте или None.
+
+        Запросы, пришедшие в течение BATCH_WINDOW, выполняются одним
+        вызовом torrents_info(torrent_hashes=...).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(magnet_hash.lower(), []).append(future)
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                BATCH_WINDOW, lambda: asyncio.ensure_future(self._flush())
+            )
+        return await future
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_handle = None
+        if not pending:
+            return
+        try:
+            torrents = await self.call("torrents_info", torrent_hashes=list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        by_hash = {t.hash.lower(): t for t in torrents}
+        for magnet_hash, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(by_hash.get(magnet_hash))
+
+
+# Общие экземпляры для бота
+qb = QBitGateway()
+tracker = DownloadTracker(qb)
@@ -0,0 +1,296 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from telegram.ext import BaseRateLimiter, BaseUpdateProcessor
+
+from service.cluster import chat_key, rate_share, share
+from service.transcoder import WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на одновременные задачи; при нескольких процессах-обработчиках
+# общие лимиты делятся между ними
+MAX_ACTIVE_DOWNLOADS = share(4)
+MAX_DOWNLOADS_PER_USER = 1
+MAX_ACTIVE_TRANSCODES = WORKERS  # очередь ffmpeg не длиннее числа обработчиков
+MAX_TRANSCODES_PER_USER = 2
+
+# Ограничения частоты исходящих запросов
+ANILIBRIA_RPS = rate_share(5)
+POSTER_RPS = rate_share(10)  # постеры отдаёт отдельный static-сервер
+TELEGRAM_GLOBAL_RPS = rate_share(25)  # Bot API допускает ~30 сообщений в секунду на бота
+TELEGRAM_CHAT_RPS = 1  # и ~1 сообщение в секунду в один чат
+TELEGRAM_CHAT_BURST = 3
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не более capacity подряд."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def try_acquire_idle(self, tokens=1):
+        """Берёт токен для фоновой работы: только если он есть сейчас и никто не ждёт в acquire()."""
+        if self._lock is not None and self._lock.locked():
+            return False
+        return self.try_acquire(tokens)
+
+    def delay(self, tokens=1):
+        """Сколько секунд ждать, пока наберётся tokens токенов."""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Очередь ожидающих обслуживается по порядку прихода
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.changed = asyncio.Event()
+
+
+class AdmissionController:
+    """Ограничение одновременных задач: общее и на пользователя.
+
+    Ожидающие обслуживаются по кругу между пользователями, поэтому один
+    пользователь с десятком запросов не задерживает остальных. Пока
+    запрос ждёт, on_position(N) сообщает его позицию в очереди.
+    """
+
+    def __init__(self, name, limit, per_user_limit):
+        self.name = name
+        self.limit = limit
+        self.per_user_limit = per_user_limit
+        self.active = 0
+        self._active_by_user = {}
+        self._queues = OrderedDict()  # user_id -> deque(_Waiter), порядок — очередь обхода
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _can_run(self, user_id):
+        return self.active < self.limit and self._active_by_user.get(user_id, 0) < self.per_user_limit
+
+    def _grant(self, user_id):
+        self.active += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+
+    def _release(self, user_id):
+        self.active -= 1
+        count = self._active_by_user.get(user_id, 0) - 1
+        if count > 0:
+            self._active_by_user[user_id] = count
+        else:
+            self._active_by_user.pop(user_id, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        granted = True
+        while granted and self.active < self.limit:
+            granted = False
+            for user_id in list(self._queues):
+                if not self._can_run(user_id):
+                    continue
+                queue = self._queues.pop(user_id)
+                waiter = queue.popleft()
+                if queue:
+                    # Пользователь уходит в конец круга
+                    self._queues[user_id] = queue
+                self._grant(user_id)
+                waiter.granted = True
+                waiter.changed.set()
+                granted = True
+                break
+        self._notify()
+
+    def _notify(self):
+        # Позиции в очереди могли измениться
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.changed.set()
+
+    def position(self, waiter):
+        """Позиция ожидающего (с 1) при обходе очередей пользователей по кругу."""
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for round_index in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if round_index < len(queue):
+                    position += 1
+                    if queue[round_index] is waiter:
+                        return position
+        return 0
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_position=None):
+        if not self._queues and self._can_run(user_id):
+            self._grant(user_id)
+        else:
+            waiter = _Waiter(user_id)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            # Свободное место может быть у других пользователей
+            self._dispatch()
+            last_position = None
+            try:
+                while not waiter.granted:
+                    position = self.position(waiter)
+                    if on_position is not None and position != last_position:
+                        last_position = position
+                        await on_position(position)
+                    if waiter.granted:
+                        break
+                    waiter.changed.clear()
+                    await waiter.changed.wait()
+            except BaseException:
+                if waiter.granted:
+                    self._release(user_id)
+                else:
+                    queue = self._queues.get(user_id)
+                    if queue is not None and waiter in queue:
+                        queue.remove(waiter)
+                        if not queue:
+                            del self._queues[user_id]
+                    self._dispatch()
+                raise
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "active": self.active,
+            "waiting": self.waiting,
+            "limit": self.limit,
+        }
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Ограничитель запросов python-telegram-bot на основе TokenBucket.
+
+    Каждый запрос расходует токен общего бюджета бота и бюджета чата.
+    """
+
+    def __init__(self, global_rps=TELEGRAM_GLOBAL_RPS, chat_rps=TELEGRAM_CHAT_RPS, chat_burst=TELEGRAM_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rps)
+        self.chat_rps = chat_rps
+        self.chat_burst = chat_burst
+        self._chat_buckets = OrderedDict()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rps, self.chat_burst)
+            # Не храним корзины всех чатов, с которыми бот когда-либо общался
+            while len(self._chat_buckets) > 10000:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id=None):
+        """Ждёт разрешения на один запрос к Bot API (в том числе мимо python-telegram-bot)."""
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        await self.acquire(data.get("chat_id"))
+        return await callback(*args, **kwargs)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates), а обновления одного чата — строго по очереди.
+    Слот общего лимита python-telegram-bot занимает только обновление,
+    которое обрабатывается: следующие обновления занятого чата ставятся
+    в его очередь и сразу освобождают слот, а выполняет их задача,
+    обработавшая первое. Так один чат с очередью держит не больше одного
+    слота и не задерживает остальные чаты.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # ключ чата -> deque ожидающих корутин
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        key = chat_key(update) if hasattr(update, "effective_chat") else None
+        if key is None:
+            await coroutine
+            return
+        pending = self._chats.get(key)
+        if pending is not None:
+            # Чат уже обрабатывается: обновление выполнит та же задача по порядку
+            pending.append(coroutine)
+            return
+        pending = self._chats[key] = deque()
+        try:
+            while coroutine is not None:
+                try:
+                    await coroutine
+                except Exception as e:
+                    # Application.process_update сам передаёт ошибки обработчиков в error handler
+                    logger.error(f"Ошибка обработки обновления чата {key}: {e}")
+                coroutine = pending.popleft() if pending else None
+        finally:
+            del self._chats[key]
+            # При отмене оставшиеся обновления чата уже не выполнятся
+            for rest in pending:
+                rest.close()
+
+    def stats(self):
+        return {
+            "name": "updates",
+            "chats": len(self._chats),
+            "queued": sum(len(pending) for pending in self._chats.values()),
+            "limit": self.max_concurrent_updates,
+        }
+
+
+# Общие ограничители для бота
+downloads = AdmissionController("downloads", MAX_ACTIVE_DOWNLOADS, MAX_DOWNLOADS_PER_USER)
+transcodes = AdmissionController("transcodes", MAX_ACTIVE_TRANSCODES, MAX_TRANSCODES_PER_USER)
+api_bucket = TokenBucket(ANILIBRIA_RPS)
+poster_bucket = TokenBucket(POSTER_RPS)
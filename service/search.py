@@ -0,0 +1,128 @@
+import re
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_query(text):
+    """Приводит запрос к каноническому виду: регистр, ё/е, пунктуация, пробелы."""
+    text = (text or "").casefold().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class TitleIndex:
+    """Локальный индекс названий, собранный из уже полученных ответов API.
+
+    Используется как запасной источник результатов, когда AniLibria
+    отвечает медленно или недоступна.
+    """
+
+    def __init__(self, maxsize=5000):
+        self.maxsize = maxsize
+        self._titles = OrderedDict()  # id -> (name, [нормализованные названия])
+
+    def add(self, anime_id, name, aliases=()):
+        names = {normalize_query(n) for n in (name, *aliases) if n}
+        names.discard("")
+        if not names:
+            return
+        self._titles[anime_id] = (name, sorted(names))
+        self._titles.move_to_end(anime_id)
+        while len(self._titles) > self.maxsize:
+            self._titles.popitem(last=False)
+
+    def add_release(self, data):
+        # Принимает объект релиза в формате API (search и /anime/releases/{id})
+        names = data.get("name") or {}
+        main = names.get("main")
+        if not main:
+            return
+        aliases = [names.get("english"), names.get("alternative")]
+        self.add(data["id"], main, [a for a in aliases if isinstance(a, str)])
+
+    def search(self, query, limit=20):
+        words = normalize_query(query).split()
+        if not words:
+            return []
+        found = []
+        for anime_id, (name, names) in reversed(self._titles.items()):
+            if any(all(word in n for word in words) for n in names):
+                found.append({"id": anime_id, "name": name})
+                if len(found) >= limit:
+                    break
+        return found
+
+    def __len__(self):
+        return len(self._titles)
+
+
+def trigrams(text):
+    # Границы слов помечаем пробелами, чтобы начало слова весило больше
+    text = f"  {normalize_query(text)} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Инвертированный индекс по триграммам названий для нечёткого поиска.
+
+    Подходит для русских и латинских (ромадзи) названий: опечатки и
+    пропущенные буквы меняют лишь часть триграмм.
+    """
+
+    def __init__(self):
+        self._postings = {}  # триграмма -> set(id)
+        self._names = {}  # id -> (название для вывода, [нормализованные названия])
+        self._grams = {}  # id -> set(триграмма)
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, anime_id, name, aliases=()):
+        self.remove(anime_id)
+        names = [n for n in {normalize_query(n) for n in (name, *aliases) if n} if n]
+        if not names:
+            return
+        grams = set()
+        for n in names:
+            grams |= trigrams(n)
+        self._names[anime_id] = (name, names)
+        self._grams[anime_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(anime_id)
+
+    def remove(self, anime_id):
+        grams = self._grams.pop(anime_id, None)
+        self._names.pop(anime_id, None)
+        for gram in grams or ():
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(anime_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def search(self, query, limit=20, threshold=0.35):
+        query = normalize_query(query)
+        grams = trigrams(query)
+        if not query or not grams:
+            return []
+        counts = {}
+        for gram in grams:
+            for anime_id in self._postings.get(gram, ()):
+                counts[anime_id] = counts.get(anime_id, 0) + 1
+
+        scored = []
+        for anime_id, hits in counts.items():
+            # Доля триграмм запроса, найденных в названии
+            score = hits / len(grams)
+            name, names = self._names[anime_id]
+            if any(query in n for n in names):
+                score += 1  # точное вхождение важнее нечёткого совпадения
+            if score >= threshold:
+                scored.append((score, anime_id, name))
+        scored.sort(key=lambda item: (-item[0], item[2]))
+        return [{"id": anime_id, "name": name} for _, anime_id, name in scored[:limit]]
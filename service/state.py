@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Какое хранилище состояния использовать: "memory" или "sqlite"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")
+STATE_DB = os.path.join("cache", "state.sqlite3")
+# Через сколько неактивный пользователь забывается
+STATE_TTL = 7 * 24 * 60 * 60  # неделя
+# Как часто накопленные изменения записываются в SQLite
+FLUSH_INTERVAL = 1.0
+
+
+class StateBackend:
+    """Интерфейс хранилища состояния пользователей.
+
+    Значение — словарь, сериализуемый в JSON. Общее для нескольких
+    процессов хранилище (Redis и т.п.) реализует эти же методы.
+    """
+
+    async def get(self, user_id):
+        raise NotImplementedError
+
+    async def set(self, user_id, data):
+        raise NotImplementedError
+
+    async def delete(self, user_id):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryStateStore(StateBackend):
+    """Состояние в памяти процесса с вытеснением неактивных пользователей по TTL."""
+
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._data = {}  # user_id -> (expires_at, data)
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        expired = [user_id for user_id, (expires_at, _) in self._data.items() if expires_at < now]
+        for user_id in expired:
+            del self._data[user_id]
+
+    async def get(self, user_id):
+        self._sweep()
+        entry = self._data.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return dict(entry[1])
+
+    async def set(self, user_id, data):
+        self._sweep()
+        self._data[user_id] = (time.monotonic() + self.ttl, dict(data))
+
+    async def delete(self, user_id):
+        self._data.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStateStore(StateBackend):
+    """Состояние в локальной SQLite с пакетной записью.
+
+    Изменения копятся в памяти и раз в FLUSH_INTERVAL записываются одной
+    транзакцией; чтение сначала смотрит в несохранённые изменения.
+    """
+
+    _DELETED = object()
+
+    def __init__(self, path=STATE_DB, ttl=STATE_TTL, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> data или _DELETED
+        self._flushing = {}  # изменения, которые сейчас записываются
+        self._flush_task = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS user_state_updated ON user_state (updated)")
+        return self._conn
+
+    def _read(self, user_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM user_state WHERE user_id = ? AND updated > ?",
+                (user_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, pending):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_state (user_id, data, updated) VALUES (?, ?, ?)",
+                    [(user_id, json.dumps(data, ensure_ascii=False), now)
+                     for user_id, data in pending.items() if data is not self._DELETED]
+                )
+                conn.executemany(
+                    "DELETE FROM user_state WHERE user_id = ?",
+                    [(user_id,) for user_id, data in pending.items() if data is self._DELETED]
+                )
+                # Заодно забываем неактивных пользователей
+                conn.execute("DELETE FROM user_state WHERE updated <= ?", (now - self.ttl,))
+
+    async def get(self, user_id):
+        data = self._pending.get(user_id, self._flushing.get(user_id))
+        if data is self._DELETED:
+            return None
+        if data is not None:
+            return dict(data)
+        return await asyncio.to_thread(self._read, user_id)
+
+    async def set(self, user_id, data):
+        self._pending[user_id] = dict(data)
+        self._schedule_flush()
+
+    async def delete(self, user_id):
+        self._pending[user_id] = self._DELETED
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._flushing = pending
+        try:
+            await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния пользователей: {e}")
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for user_id, data in pending.items():
+                self._pending.setdefault(user_id, data)
+        finally:
+            self._flushing = {}
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_backend(kind=STATE_BACKEND):
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "sqlite":
+        return SqliteStateStore()
+    raise ValueError(f"Неизвестное хранилище состояния: {kind}")
+
+
+class Session:
+    """Диалог с одним пользователем: текущее состояние и произвольные данные."""
+
+    def __init__(self, store, user_id, data=None):
+        self.store = store
+        self.user_id = user_id
+        self.data = data or {}
+
+    @property
+    def state(self):
+        return self.data.get("state")
+
+    @state.setter
+    def state(self, value):
+        self.data["state"] = value
+
+    async def save(self):
+        if any(value is not None for value in self.data.values()):
+            await self.store.set(self.user_id, self.data)
+        else:
+            await self.store.delete(self.user_id)
+
+
+class SessionStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def get(self, user_id):
+        return Session(self.backend, user_id, await self.backend.get(user_id))
+
+    async def set_state(self, user_id, state):
+        session = await self.get(user_id)
+        session.state = state
+        await session.save()
+        return session
+
+    async def close(self):
+        await self.backend.close()
+
+
+# Общее хранилище сессий
+sessions = SessionStore(create_backend())
@@ -0,0 +1,209 @@
+import os
+import shutil
+import asyncio
+import logging
+
+from service.jobs import jobs
+from service.qbit import qb
+from service.transcode_cache import transcode_cache
+
+logger = logging.getLogger(__name__)
+
+# Временные файлы ffmpeg; у каждого процесса свой каталог
+WORK_DIR = os.path.join("cache", "work")
+# Метка торрентов, которые добавил бот: чужие торренты qBittorrent не трогаем
+QB_TAG = "anilibria-bot"
+# Общий бюджет на оригиналы, временные и сжатые файлы
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", str(40 * 1024 ** 3)))  # 40GB
+# Сколько места оставляем свободным на каждом диске с файлами бота
+STORAGE_MIN_FREE_BYTES = int(os.environ.get("STORAGE_MIN_FREE_BYTES", str(5 * 1024 ** 3)))  # 5GB
+# Как часто проверяем бюджет в фоне и сколько ждём места перед новой загрузкой
+STORAGE_CHECK_INTERVAL = 60
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _disk_free(path):
+    # Каталог может быть ещё не создан: смотрим ближайший существующий
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+class MediaStorage:
+    """Учёт и очистка медиафайлов бота на диске.
+
+    Оригиналы — файлы торрентов qBittorrent с меткой QB_TAG, временные
+    результаты ffmpeg лежат в каталоге процесса внутри WORK_DIR, готовые
+    сжатые файлы — в TranscodeCache. Если всё вместе занимает больше
+    max_bytes или на диске остаётся меньше min_free, сначала удаляются
+    торренты, которые никому больше не нужны (завершённые — первыми),
+    затем давно не использованные записи кэша сжатых файлов. Файлы идущих
+    загрузок не трогаются.
+    """
+
+    def __init__(self, root=WORK_DIR, max_bytes=STORAGE_MAX_BYTES, min_free=STORAGE_MIN_FREE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.work_root = os.path.join(root, str(os.getpid()))
+        self.usage = {}
+        self.evicted_torrents = 0
+        self.freed_bytes = 0
+        self._active = set()
+        self._lock = None
+        self._released = None
+        self._task = None
+
+    def _ensure_primitives(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._released = asyncio.Event()
+
+    def work_dir(self, magnet_hash):
+        return os.path.join(self.work_root, magnet_hash.lower())
+
+    async def begin_work(self, magnet_hash):
+        """Отмечает загрузку как идущую и создаёт её каталог для временных файлов."""
+        self._active.add(magnet_hash.lower())
+        await asyncio.to_thread(os.makedirs, self.work_dir(magnet_hash), exist_ok=True)
+
+    async def finish_work(self, magnet_hash):
+        """Удаляет временные файлы загрузки: сжатое уже перенесено в кэш."""
+        self._ensure_primitives()
+        self._active.discard(magnet_hash.lower())
+        await asyncio.to_thread(shutil.rmtree, self.work_dir(magnet_hash), True)
+        self._released.set()
+
+    async def _measure(self):
+        torrents = await qb.call("torrents_info", tag=QB_TAG)
+        usage = {
+            "originals": sum(t.get("completed", 0) for t in torrents),
+            "work": await asyncio.to_thread(_dir_size, self.root),
+            "transcoded": await transcode_cache.usage(),
+        }
+        paths = {t.get("save_path") for t in torrents if t.get("save_path")} | {self.root, transcode_cache.root}
+        free = []
+        for path in paths:
+            free.append(await asyncio.to_thread(_disk_free, path))
+        usage["free"] = min(free)
+        return torrents, usage
+
+    async def enforce(self):
+        """Освобождает место под бюджет; True, если уложились."""
+        self._ensure_primitives()
+        async with self._lock:
+            torrents, usage = await self._measure()
+            self.usage = usage
+            used = usage["originals"] + usage["work"] + usage["transcoded"]
+            excess = max(used - self.max_bytes, self.min_free - usage["free"])
+            if excess <= 0:
+                return True
+            logger.info(f"Занято {used} байт, свободно {usage['free']}: освобождаем {excess} байт")
+
+            # Сначала торренты, которые никому не нужны: завершённые, затем самые старые
+            torrents = sorted(torrents, key=lambda t: (t.get("progress", 0) < 1, t.get("added_on", 0)))
+            for torrent in torrents:
+                if excess <= 0:
+                    break
+                if torrent.hash.lower() in self._active or await jobs.in_use(torrent.hash):
+                    continue
+                await qb.delete([torrent.hash], delete_files=True)
+                freed = torrent.get("completed", 0)
+                excess -= freed
+                self.freed_bytes += freed
+                self.evicted_torrents += 1
+                logger.info(f"Торрент {torrent.hash} удалён для освобождения места ({freed} байт)")
+
+            if excess > 0:
+                freed = await transcode_cache.shrink(max(0, usage["transcoded"] - excess), in_use=jobs.in_use)
+                excess -= freed
+                self.freed_bytes += freed
+
+            if excess > 0:
+                logger.warning(f"Не удалось освободить {excess} байт: место занято идущими загрузками")
+                return False
+            return True
+
+    async def wait_for_room(self, magnet_hash, on_wait=None):
+        """Ждёт, пока бюджет позволит начать загрузку, если место занимают другие загрузки."""
+        self._ensure_primitives()
+        notified = False
+        while True:
+            try:
+                if await self.enforce():
+                    return
+            except Exception as e:
+                logger.error(f"Ошибка проверки места на диске: {e}")
+                return
+            if not self._active - {magnet_hash.lower()}:
+                # Ждать нечего: место не освободится само
+                logger.warning(f"Загрузка {magnet_hash} начинается сверх бюджета на диске")
+                return
+            if on_wait is not None and not notified:
+                await on_wait()
+                notified = True
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), STORAGE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cleanup_orphans(self):
+        """Удаляет временные файлы ffmpeg, оставшиеся от прошлых запусков.
+
+        Вызывается при старте, пока ни один процесс-обработчик не работает.
+        Торренты прошлых запусков остаются в qBittorrent и удаляются по
+        бюджету в первую очередь; файлы вне каталогов бота не трогаются.
+        """
+        await asyncio.to_thread(shutil.rmtree, self.root, True)
+        logger.info("Очистка при запуске: временные файлы прошлых запусков удалены")
+
+    def drop_worker(self, pid):
+        """Удаляет временные файлы завершившегося процесса-обработчика (вызывает супервизор)."""
+        shutil.rmtree(os.path.join(self.root, str(pid)), ignore_errors=True)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.enforce()
+            except Exception as e:
+                logger.error(f"Ошибка проверки места на диске: {e}")
+            await asyncio.sleep(STORAGE_CHECK_INTERVAL)
+
+    def stats(self):
+        return {
+            "name": "media",
+            **self.usage,
+            "max_bytes": self.max_bytes,
+            "active": len(self._active),
+            "evicted_torrents": self.evicted_torrents,
+            "freed_bytes": self.freed_bytes,
+        }
+
+
+# Общий менеджер медиафайлов
+storage = MediaStorage()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Как часто опрашиваем qBittorrent, пока есть отслеживаемые загрузки
+POLL_INTERVAL = 5
+# Сколько ждём появления торрента после добавления
+APPEAR_TIMEOUT = 60
+
+# Состояния qBittorrent, означающие, что загрузка завершена
+COMPLETED_STATES = {
+    "uploading", "stalledUP", "pausedUP", "stoppedUP",
+    "queuedUP", "forcedUP", "checkingUP",
+}
+
+
+def is_complete(torrent):
+    return torrent.get("progress", 0) >= 1 or torrent.get("state") in COMPLETED_STATES
+
+
+class DownloadTracker:
+    """Фоновое отслеживание загрузок qBittorrent.
+
+    Одна задача опрашивает /sync/maindata и получает только изменения
+    с прошлого опроса (по rid). Снимки состояния рассылаются всем
+    подписчикам торрента, поэтому один опрос обслуживает любое число
+    загрузок и чатов.
+    """
+
+    def __init__(self, qb, interval=POLL_INTERVAL):
+        self.qb = qb
+        self.interval = interval
+        self._rid = 0
+        self._torrents = {}  # hash -> слитое состояние торрента
+        self._watchers = {}  # hash -> set(asyncio.Queue)
+        self._wakeup = None
+        self._task = None
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"watched": len(self._watchers), "known": len(self._torrents), "rid": self._rid}
+
+    def get(self, magnet_hash):
+        return self._torrents.get(magnet_hash.lower())
+
+    async def track(self, magnet_hash, appear_timeout=APPEAR_TIMEOUT):
+        """Асинхронно выдаёт снимки состояния торрента до завершения загрузки.
+
+        Если торрент так и не появился в qBittorrent или был удалён,
+        генератор завершается, не дойдя до завершённого состояния.
+        """
+        magnet_hash = magnet_hash.lower()
+        queue = asyncio.Queue()
+        self._watchers.setdefault(magnet_hash, set()).add(queue)
+        self._ensure_running()
+        self._wakeup.set()
+
+        try:
+            # Торрент мог уже быть известен по предыдущим опросам
+            current = self._torrents.get(magnet_hash)
+            if current is not None:
+                yield dict(current)
+                if is_complete(current):
+                    return
+
+            seen = current is not None
+            while True:
+                timeout = None if seen else appear_timeout
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"Торрент {magnet_hash} не появился в qBittorrent за {appear_timeout} с")
+                    return
+                if snapshot is None:
+                    logger.warning(f"Торрент {magnet_hash} удалён из qBittorrent")
+                    return
+                seen = True
+                yield snapshot
+                if is_complete(snapshot):
+                    return
+        finally:
+            watchers = self._watchers.get(magnet_hash)
+            if watchers is not None:
+                watchers.discard(queue)
+                if not watchers:
+                    del self._watchers[magnet_hash]
+
+    async def _run(self):
+        while True:
+            if not self._watchers:
+                # Нечего отслеживать — не нагружаем qBittorrent
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            try:
+                await self._poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка опроса qBittorrent: {e}")
+                # Начинаем синхронизацию заново
+                self._rid = 0
+            await asyncio.sleep(self.interval)
+
+    async def _poll(self):
+        data = await self.qb.maindata(self._rid)
+        self._rid = data.get("rid", 0)
+
+        removed = {h.lower() for h in (data.get("torrents_removed") or [])}
+        if data.get("full_update"):
+            # Полный снимок: всё, чего в нём нет, считаем удалённым
+            fresh = {h.lower() for h in (data.get("torrents") or {})}
+            removed.update(set(self._torrents) - fresh)
+            self._torrents.clear()
+
+        changed = set()
+        for magnet_hash, delta in (data.get("torrents") or {}).items():
+            magnet_hash = magnet_hash.lower()
+            torrent = self._torrents.setdefault(magnet_hash, {"hash": magnet_hash})
+            torrent.update(delta)
+            changed.add(magnet_hash)
+
+        for magnet_hash in removed:
+            self._torrents.pop(magnet_hash, None)
+
+        for magnet_hash, watchers in self._watchers.items():
+            if magnet_hash in removed:
+                snapshot = None
+            elif magnet_hash in changed:
+                snapshot = dict(self._torrents[magnet_hash])
+            else:
+                continue
+            for queue in watchers:
+                queue.put_nowait(snapshot)
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join("cache", "transcoded")
+# Предельный размер кэша на диске
+CACHE_MAX_BYTES = 20 * 1024 ** 3  # 20GB
+# Запись без meta.json младше этого может ещё дописывать другой процесс-обработчик
+INCOMPLETE_TTL = 60 * 60
+
+
+def cache_key(torrent_hash, file_name, profile):
+    raw = f"{torrent_hash.lower()}\0{file_name}\0{profile}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TranscodeCache:
+    """Дисковый кэш сжатых файлов с адресацией по содержимому.
+
+    Ключ — хэш торрента, путь файла внутри торрента и профиль сжатия.
+    Для каждого торрента дополнительно хранится список его файлов, чтобы
+    повторный запрос можно было обслужить без qBittorrent и ffmpeg.
+    Размер ограничен CACHE_MAX_BYTES, вытесняются давно не использованные
+    записи. Записи торрента, закреплённого через pinned(), пока идёт его
+    отправка, не вытесняются. Каталог общий для процессов-обработчиков,
+    поэтому перед подсчётом размера и вытеснением индекс перечитывается
+    с диска, а меткой LRU служит время изменения meta.json.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = None  # key -> [размер, время последнего обращения, хэш торрента]
+        self._pinned = {}  # хэш торрента -> число отправок, которые его используют
+        self._lock = None
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _manifest_path(self, torrent_hash, profile):
+        name = hashlib.sha256(f"{torrent_hash.lower()}\0{profile}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "torrents", f"{name}.json")
+
+    async def _ensure_loaded(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._entries is None:
+            self._entries = await asyncio.to_thread(self._scan)
+            logger.info(f"Кэш сжатых файлов: {len(self._entries)} записей, {self.size} байт")
+
+    def _scan(self):
+        entries = {}
+        if not os.path.isdir(self.root):
+            return entries
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if prefix == "torrents" or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                meta_path = os.path.join(prefix_dir, key, "meta.json")
+                try:
+                    with open(meta_path, encoding="utf-8") as f:
+                        meta = json.load(f)
+                    entries[key] = [meta["size"], os.path.getmtime(meta_path), meta.get("torrent_hash", "")]
+                except (OSError, ValueError, KeyError):
+                    # Незавершённая или повреждённая запись
+                    entry_dir = os.path.join(prefix_dir, key)
+                    try:
+                        if time.time() - os.path.getmtime(entry_dir) > INCOMPLETE_TTL:
+                            shutil.rmtree(entry_dir, ignore_errors=True)
+                    except OSError:
+                        pass
+        return entries
+
+    async def _refresh(self):
+        # Вызывается под self._lock: другие процессы могли добавить или вытеснить записи
+        self._entries = await asyncio.to_thread(self._scan)
+
+    @property
+    def size(self):
+        return sum(entry[0] for entry in (self._entries or {}).values())
+
+    async def get(self, torrent_hash, file_name, profile):
+        """Пути к сжатым частям файла или None при промахе."""
+        await self._ensure_loaded()
+        key = cache_key(torrent_hash, file_name, profile)
+        # Запись мог добавить другой процесс-обработчик, поэтому проверяем диск и при промахе в индексе
+        found = await asyncio.to_thread(self._read_entry, key)
+        if found is None:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        paths, meta = found
+        self._entries[key] = [meta["size"], time.time(), meta.get("torrent_hash", "")]
+        self.hits += 1
+        return paths
+
+    def _read_entry(self, key):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            paths = [os.path.join(entry_dir, name) for name in meta["parts"]]
+            if not all(os.path.exists(path) for path in paths):
+                return None
+            # Время изменения meta.json служит меткой LRU между перезапусками и процессами
+            os.utime(meta_path)
+            return paths, meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    async def put(self, torrent_hash, file_name, profile, paths):
+        """Переносит готовые файлы в кэш и возвращает их новые пути."""
+        await self._ensure_loaded()
+        key = cache_key(torrent_hash, file_name, profile)
+        meta = {
+            "torrent_hash": torrent_hash.lower(),
+            "file": file_name,
+            "profile": profile,
+        }
+        async with self._lock:
+            cached, size = await asyncio.to_thread(self._write_entry, key, paths, meta)
+            await self._refresh()
+            await self._shrink(self.max_bytes)
+        return cached
+
+    def _write_entry(self, key, paths, meta):
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        parts = []
+        size = 0
+        for index, path in enumerate(paths, start=1):
+            name = f"part{index}{os.path.splitext(path)[1]}"
+            target = os.path.join(entry_dir, name)
+            shutil.move(path, target)
+            parts.append(name)
+            size += os.path.getsize(target)
+        meta.update(parts=parts, size=size)
+        # meta.json пишется последним: запись без него считается незавершённой
+        tmp_path = os.path.join(entry_dir, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(entry_dir, "meta.json"))
+        return [os.path.join(entry_dir, name) for name in parts], size
+
+    async def get_torrent(self, torrent_hash, profile):
+        """Все файлы торрента из кэша: [(имя файла, [пути])] или None, если чего-то нет."""
+        await self._ensure_loaded()
+        try:
+            manifest = await asyncio.to_thread(self._read_json, self._manifest_path(torrent_hash, profile))
+        except (OSError, ValueError):
+            return None
+        result = []
+        for file_name in manifest["files"]:
+            paths = await self.get(torrent_hash, file_name, profile)
+            if paths is None:
+                return None
+            result.append((file_name, paths))
+        return result
+
+    async def put_torrent(self, torrent_hash, profile, file_names):
+        path = self._manifest_path(torrent_hash, profile)
+        await asyncio.to_thread(self._write_json, path, {"files": list(file_names)})
+
+    @staticmethod
+    def _read_json(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def _shrink(self, max_bytes, in_use=None):
+        total = self.size
+        freed = 0
+        for key, (size, _, torrent_hash) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if total <= max_bytes:
+                break
+            if torrent_hash in self._pinned or (in_use is not None and await in_use(torrent_hash)):
+                # Файлы ещё ждут отправки подписчикам в этом или другом процессе
+                continue
+            await asyncio.to_thread(shutil.rmtree, self._entry_dir(key), True)
+            del self._entries[key]
+            total -= size
+            freed += size
+            logger.info(f"Запись {key} вытеснена из кэша сжатых файлов")
+        return freed
+
+    @contextmanager
+    def pinned(self, torrent_hash):
+        """Не даёт вытеснить сжатые файлы торрента, пока они отправляются."""
+        torrent_hash = torrent_hash.lower()
+        self._pinned[torrent_hash] = self._pinned.get(torrent_hash, 0) + 1
+        try:
+            yield
+        finally:
+            count = self._pinned[torrent_hash] - 1
+            if count:
+                self._pinned[torrent_hash] = count
+            else:
+                del self._pinned[torrent_hash]
+
+    async def usage(self):
+        """Сколько байт занимают сжатые файлы на диске, включая записи других процессов."""
+        await self._ensure_loaded()
+        async with self._lock:
+            await self._refresh()
+        return self.size
+
+    async def shrink(self, max_bytes, in_use=None):
+        """Вытесняет давно не использованные записи, пока кэш больше max_bytes; возвращает освобождённые байты.
+
+        in_use(хэш торрента) — дополнительная проверка, что торрент ещё нужен.
+        """
+        await self._ensure_loaded()
+        async with self._lock:
+            await self._refresh()
+            return await self._shrink(max_bytes, in_use)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": "transcoded",
+            "size": len(self._entries or {}),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Общий кэш сжатых файлов
+transcode_cache = TranscodeCache()
@@ -0,0 +1,331 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import platform
+
+from service.cluster import share
+from service.metrics import ffmpeg_duration
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = "ffmpeg.exe" if platform.system() == "Windows" else "ffmpeg"
+FFPROBE = "ffprobe.exe" if platform.system() == "Windows" else "ffprobe"
+
+# Ядра делятся между процессами-обработчиками бота
+CPU_COUNT = share(os.cpu_count() or 1)
+# x264 сам использует несколько потоков, поэтому делим ядра между задачами
+WORKERS = max(1, CPU_COUNT // 2)
+THREADS_PER_JOB = max(1, CPU_COUNT // WORKERS)
+
+# Параметры сжатия по умолчанию
+VIDEO_BITRATE = "500k"
+AUDIO_BITRATE = "128k"
+PRESET = "fast"
+
+# Ограничение Telegram Bot API на размер отправляемого файла
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB
+AUDIO_KBPS = 128
+# Запас на контейнер mp4 и неточность управления битрейтом
+MUX_OVERHEAD = 0.04
+# Ниже этого битрейта качество неприемлемо — вместо этого делим серию на части
+MIN_VIDEO_KBPS = 300
+# Сколько раз повторяем кодирование, если результат всё же не влез
+MAX_ATTEMPTS = 2
+
+
+def target_video_kbps(duration, max_size=MAX_UPLOAD_SIZE, audio_kbps=AUDIO_KBPS, source_kbps=None):
+    """Битрейт видео (кбит/с), при котором файл длительностью duration влезет в max_size.
+
+    Не выше исходного общего битрейта source_kbps: больший битрейт только
+    увеличит файл, не добавив качества.
+    """
+    total_kbps = max_size * 8 / 1000 / duration * (1 - MUX_OVERHEAD)
+    if source_kbps:
+        total_kbps = min(total_kbps, source_kbps)
+    return max(1, int(total_kbps - audio_kbps))
+
+
+def encode_profile(max_size=MAX_UPLOAD_SIZE):
+    """Строка, однозначно описывающая параметры сжатия (для ключей кэша)."""
+    return f"x264-2pass-{PRESET}-a{AUDIO_KBPS}-max{max_size}-min{MIN_VIDEO_KBPS}"
+
+
+def split_count(duration, max_size=MAX_UPLOAD_SIZE, audio_kbps=AUDIO_KBPS, source_kbps=None):
+    """На сколько частей нужно разделить файл, чтобы каждая влезла с битрейтом не ниже минимального.
+
+    Файл, который влезает уже с исходным битрейтом source_kbps, не делится.
+    """
+    total_kbps = MIN_VIDEO_KBPS + audio_kbps
+    if source_kbps:
+        total_kbps = min(total_kbps, source_kbps)
+    part_duration = max_size * 8 / 1000 * (1 - MUX_OVERHEAD) / total_kbps
+    return max(1, math.ceil(duration / part_duration))
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def probe_format(input_path):
+    """Длительность (с) и общий битрейт (кбит/с) файла по данным ffprobe; None, если неизвестны."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE, "-v", "error", "-show_entries", "format=duration,bit_rate,size",
+            "-of", "json", input_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        logger.error(f"{FFPROBE} не найден")
+        return None, None
+    stdout, _ = await process.communicate()
+    try:
+        info = json.loads(stdout.decode() or "{}").get("format") or {}
+    except ValueError:
+        return None, None
+    duration = _number(info.get("duration"))
+    bit_rate = _number(info.get("bit_rate"))
+    size = _number(info.get("size"))
+    if not bit_rate and size and duration:
+        bit_rate = size * 8 / duration
+    return duration, bit_rate / 1000 if bit_rate else None
+
+
+class TranscodeJob:
+    """Задача сжатия одного файла в очереди Transcoder."""
+
+    def __init__(self, input_path, output_path, args, on_progress=None, max_size=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.args = args
+        self.on_progress = on_progress
+        self.max_size = max_size
+        self.outputs = []
+        self.steps = 1
+        self.progress = 0.0
+        self.state = "queued"  # queued, running, done, failed, cancelled
+        self.duration = None
+        self.source_kbps = None
+        self._process = None
+        self._future = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        if self._future.done():
+            return
+        self.state = "cancelled"
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+        self._future.cancel()
+
+    @property
+    def cancelled(self):
+        return self.state == "cancelled"
+
+    async def wait(self):
+        """Список путей к результату (несколько — если файл разделён на части).
+
+        При ошибке ffmpeg выбрасывает TranscodeError.
+        """
+        return await asyncio.shield(self._future)
+
+    def _report(self, progress):
+        self.progress = progress
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self)
+            except Exception as e:
+                logger.warning(f"Ошибка в обработчике прогресса сжатия: {e}")
+
+
+class Transcoder:
+    """Пул процессов ffmpeg с общей очередью задач для всех пользователей."""
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self.running = 0
+
+    def _ensure_running(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    @property
+    def queued(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, input_path, output_path, args=None, on_progress=None, max_size=None):
+        """Ставит файл в очередь на сжатие и возвращает TranscodeJob.
+
+        С max_size битрейт подбирается по длительности файла и кодирование
+        идёт в два прохода, чтобы результат сразу влез в ограничение.
+        """
+        self._ensure_running()
+        if args is None:
+            args = [
+                "-c:v", "libx264", "-b:v", VIDEO_BITRATE, "-preset", PRESET,
+                "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+            ]
+        job = TranscodeJob(input_path, output_path, args, on_progress, max_size)
+        self._queue.put_nowait(job)
+        logger.info(f"Файл {input_path} поставлен в очередь сжатия, в очереди: {self.queued}")
+        return job
+
+    def stats(self):
+        return {"name": "transcoder", "queued": self.queued, "running": self.running, "workers": self.workers}
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, number):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.cancelled:
+                    continue
+                self.running += 1
+                started = time.monotonic()
+                try:
+                    await self._run(job)
+                finally:
+                    self.running -= 1
+                    # "running" здесь значит, что _run завершился исключением
+                    result = "failed" if job.state == "running" else job.state
+                    ffmpeg_duration.observe(time.monotonic() - started, result=result)
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработчика сжатия {number}: {e}")
+                if not job._future.done():
+                    job.state = "failed"
+                    job._future.set_exception(TranscodeError(str(e)))
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.state = "running"
+        job.duration, job.source_kbps = await probe_format(job.input_path)
+        try:
+            if job.max_size and job.duration:
+                await self._run_targeted(job)
+            else:
+                job.steps = 1
+                await self._encode(job, [], job.args, job.output_path, 0)
+                job.outputs = [job.output_path]
+        except TranscodeError as e:
+            for path in job.outputs + [job.output_path]:
+                _remove_partial(path)
+            if job.cancelled:
+                logger.info(f"Сжатие {job.input_path} отменено")
+                return
+            job.state = "failed"
+            job._future.set_exception(e)
+            return
+
+        job.state = "done"
+        if job.progress < 1.0:
+            job._report(1.0)
+        job._future.set_result(job.outputs)
+
+    async def _run_targeted(self, job):
+        # Если при минимальном приемлемом битрейте файл не влезает — делим его на части
+        parts = split_count(job.duration, job.max_size, source_kbps=job.source_kbps)
+        part_duration = job.duration / parts
+        job.steps = parts * 2
+        if parts > 1:
+            logger.info(f"{job.input_path} будет разделён на {parts} частей")
+            root, ext = os.path.splitext(job.output_path)
+            outputs = [f"{root}_part{i + 1}{ext}" for i in range(parts)]
+        else:
+            outputs = [job.output_path]
+
+        for index, output_path in enumerate(outputs):
+            seek = ["-ss", f"{index * part_duration:.3f}", "-t", f"{part_duration:.3f}"] if parts > 1 else []
+            kbps = target_video_kbps(part_duration, job.max_size, source_kbps=job.source_kbps)
+            job.outputs.append(output_path)
+            for attempt in range(MAX_ATTEMPTS):
+                await self._encode_two_pass(job, seek, kbps, output_path, index * 2)
+                size = os.path.getsize(output_path)
+                if size <= job.max_size:
+                    break
+                # Уменьшаем битрейт пропорционально превышению и пробуем ещё раз
+                kbps = int(kbps * job.max_size / size * 0.97)
+                logger.warning(f"{output_path}: {size} байт больше лимита, повтор с битрейтом {kbps}k")
+            else:
+                raise TranscodeError(f"Не удалось уложить {output_path} в {job.max_size} байт")
+
+    async def _encode_two_pass(self, job, seek, kbps, output_path, step):
+        passlog = f"{output_path}.passlog"
+        video = ["-c:v", "libx264", "-b:v", f"{kbps}k", "-preset", PRESET, "-passlogfile", passlog]
+        try:
+            await self._encode(job, seek, [*video, "-pass", "1", "-an", "-f", "null"], "-", step)
+            await self._encode(
+                job, seek,
+                [*video, "-pass", "2", "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k"],
+                output_path, step + 1
+            )
+        finally:
+            for suffix in ("-0.log", "-0.log.mbtree"):
+                _remove_partial(passlog + suffix)
+
+    async def _encode(self, job, input_args, args, output_path, step):
+        if job.cancelled:
+            raise TranscodeError("Сжатие отменено")
+        segment = job.duration / (job.steps // 2) if job.max_size and job.duration else job.duration
+        cmd = [
+            FFMPEG, "-y", "-hide_banner", "-loglevel", "error",
+            "-nostats", "-progress", "pipe:1",
+            *input_args, "-i", job.input_path, "-threads", str(THREADS_PER_JOB),
+            *args, output_path,
+        ]
+        logger.info(f"Запуск ffmpeg для {job.input_path} (шаг {step + 1}/{job.steps})")
+        job._process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr_task = asyncio.create_task(job._process.stderr.read())
+        async for line in job._process.stdout:
+            key, _, value = line.decode(errors="ignore").strip().partition("=")
+            if key == "out_time_us" and segment:
+                try:
+                    fraction = min(1.0, int(value) / 1_000_000 / segment)
+                except ValueError:
+                    continue
+                job._report((step + fraction) / job.steps)
+        returncode = await job._process.wait()
+        stderr = (await stderr_task).decode(errors="ignore").strip()
+
+        if job.cancelled:
+            raise TranscodeError("Сжатие отменено")
+        if returncode != 0:
+            raise TranscodeError(stderr[-500:] or f"ffmpeg завершился с кодом {returncode}")
+
+
+def _remove_partial(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить незавершённый файл {path}: {e}")
+
+
+# Общий пул сжатия для бота
+transcoder = Transcoder()
@@ -0,0 +1,130 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+import httpx
+
+from telegram import Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Размер куска, которым файл читается с диска и уходит в сеть
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Загрузка 50MB при медленном канале может идти минуты
+UPLOAD_TIMEOUT = httpx.Timeout(connect=30.0, read=300.0, write=300.0, pool=60.0)
+# Сколько раз повторяем загрузку после 429 от Bot API
+MAX_ATTEMPTS = 3
+
+
+def _quote(value):
+    # Имя файла идёт в заголовок части multipart как есть
+    return str(value).replace("\"", "'").replace("\r", " ").replace("\n", " ")
+
+
+class StreamingUploader:
+    """Отправка документов в Bot API потоком с диска.
+
+    python-telegram-bot читает загружаемый файл в память целиком. Здесь
+    тело multipart/form-data собирается на лету, а файл читается кусками
+    по UPLOAD_CHUNK_SIZE вне event loop, поэтому расход памяти не зависит
+    от размера файла. Запросы проходят через rate_limiter бота, если это
+    TelegramRateLimiter.
+    """
+
+    def __init__(self, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._client = None
+
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=UPLOAD_TIMEOUT)
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def _body(self, head, path, tail):
+        yield head
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+        yield tail
+
+    @staticmethod
+    def _raise_for(data, status_code):
+        description = data.get("description") or f"HTTP {status_code}"
+        code = data.get("error_code", status_code)
+        if code == 400:
+            raise BadRequest(description)
+        if code == 403:
+            raise Forbidden(description)
+        raise TelegramError(description)
+
+    async def send_document(self, bot, chat_id, path, caption=None, message_thread_id=None, reply_to=None):
+        """Отправляет файл path как документ и возвращает telegram.Message."""
+        fields = {"chat_id": chat_id}
+        if caption:
+            fields["caption"] = caption
+        if message_thread_id is not None:
+            fields["message_thread_id"] = message_thread_id
+        if reply_to is not None:
+            fields["reply_parameters"] = json.dumps({"message_id": reply_to})
+
+        boundary = uuid.uuid4().hex
+        head = b"".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+            for name, value in fields.items()
+        ) + (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="document"; '
+            f'filename="{_quote(os.path.basename(path))}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        size = await asyncio.to_thread(os.path.getsize, path)
+        headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            # С известной длиной тело уходит без chunked-кодирования
+            "Content-Length": str(len(head) + size + len(tail)),
+        }
+
+        limiter = getattr(bot, "rate_limiter", None)
+        for attempt in range(MAX_ATTEMPTS):
+            if hasattr(limiter, "acquire"):
+                await limiter.acquire(chat_id)
+            try:
+                response = await self.client().post(
+                    f"{bot.base_url}/sendDocument", content=self._body(head, path, tail), headers=headers
+                )
+            except httpx.TimeoutException as e:
+                raise TimedOut(str(e)) from e
+            except httpx.HTTPError as e:
+                raise NetworkError(str(e)) from e
+
+            try:
+                data = response.json()
+            except ValueError:
+                raise NetworkError(f"Некорректный ответ Bot API: HTTP {response.status_code}")
+            if data.get("ok"):
+                return Message.de_json(data["result"], bot)
+
+            retry_after = (data.get("parameters") or {}).get("retry_after")
+            if retry_after is None:
+                self._raise_for(data, response.status_code)
+            if attempt + 1 == MAX_ATTEMPTS:
+                raise RetryAfter(retry_after)
+            logger.warning(f"Превышен лимит Telegram при загрузке {path}, повтор через {retry_after} с")
+            await asyncio.sleep(retry_after)
+
+
+# Общий загрузчик файлов
+uploader = StreamingUploader()
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from service.cache import TTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache("test")
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_fetch("key", loader) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["value"] * 3
+    assert len(loads) == 1
+    assert cache.get("key") == "value"
+
+
+def test_loader_error_reaches_every_waiter_and_is_not_cached():
+    cache = TTLCache("test")
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def scenario():
+        return await asyncio.gather(
+            cache.get_or_fetch("key", loader), cache.get_or_fetch("key", loader), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get("key") is None
+
+
+def test_cancelled_loader_does_not_cancel_waiters():
+    cache = TTLCache("test")
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return len(loads)
+
+    async def scenario():
+        # Например, предзагрузка, которую отменили при остановке
+        background = asyncio.create_task(cache.get_or_fetch("key", loader))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_fetch("key", loader))
+        await asyncio.sleep(0.01)
+        background.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await background
+        value = await waiter
+        return waiter, value
+
+    waiter, value = asyncio.run(scenario())
+    assert not waiter.cancelled()
+    assert value == 2
+    assert len(loads) == 2
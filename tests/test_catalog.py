@@ -0,0 +1,128 @@
+import os
+import json
+import asyncio
+
+from service.catalog import Catalog, FixtureCatalogSource
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "releases.json")
+
+
+class _CountingSource(FixtureCatalogSource):
+    """Источник из фикстуры, который запоминает запрошенные карточки релизов."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.requested = []
+
+    async def release(self, release_id):
+        self.requested.append(release_id)
+        return await super().release(release_id)
+
+
+def _changed_fixture(tmp_path, release_id, **fields):
+    with open(FIXTURE, encoding="utf-8") as f:
+        releases = json.load(f)
+    for release in releases:
+        if release["id"] == release_id:
+            release.update(fields)
+    path = tmp_path / "releases.json"
+    path.write_text(json.dumps(releases, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_full_sync_mirrors_fixture(tmp_path):
+    catalog = Catalog(path=str(tmp_path / "catalog.json"))
+    changed = asyncio.run(catalog.sync(FixtureCatalogSource(FIXTURE)))
+
+    assert changed == 6
+    assert catalog.ready
+    release = catalog.get(9002)
+    assert release["name"]["main"] == "Магическая битва"
+    assert release["poster"]["src"] == "/storage/releases/posters/9002/poster.jpg"
+    assert [t["quality"]["value"] for t in release["torrents"]] == ["720p", "1080p"]
+    assert "seeders" not in release["torrents"][0]
+
+    # Сохранённое зеркало читается новым процессом без обращения к API
+    restored = Catalog(path=catalog.path)
+    asyncio.run(restored.load())
+    assert restored.ready
+    assert restored.get(9002) == release
+    assert restored.search("магическая битва")[0]["id"] == 9002
+
+
+def test_incremental_sync_fetches_only_changed_releases(tmp_path):
+    catalog = Catalog(path=str(tmp_path / "catalog.json"))
+    asyncio.run(catalog.sync(FixtureCatalogSource(FIXTURE)))
+
+    unchanged = _CountingSource(FIXTURE)
+    assert asyncio.run(catalog.sync(unchanged)) == 0
+    assert unchanged.requested == []
+
+    updated = _CountingSource(_changed_fixture(
+        tmp_path, 9001,
+        updated_at="2024-07-01T10:00:00+00:00",
+        name={"main": "Ванпанчмен 3", "english": "One Punch Man 3", "alternative": None},
+    ))
+    assert asyncio.run(catalog.sync(updated)) == 1
+    assert updated.requested == [9001]
+    assert catalog.get(9001)["name"]["main"] == "Ванпанчмен 3"
+    assert catalog.search("ванпанчмен 3")[0]["id"] == 9001
+
+
+def test_upsert_keeps_known_torrents(tmp_path):
+    catalog = Catalog(path=str(tmp_path / "catalog.json"))
+    source = FixtureCatalogSource(FIXTURE)
+    full = asyncio.run(source.release(9004))
+    assert catalog.upsert(full)
+
+    # Запись из списка каталога приходит без торрентов
+    listed = {key: value for key, value in full.items() if key != "torrents"}
+    assert not catalog.upsert(listed)
+    assert [t["hash"] for t in catalog.get(9004)["torrents"]] == [t["hash"] for t in full["torrents"]]
+
+    listed["description"] = "Новое описание"
+    assert catalog.upsert(listed)
+    assert catalog.get(9004)["description"] == "Новое описание"
+    assert len(catalog.get(9004)["torrents"]) == 2
+
+
+def test_trigram_search_tolerates_typos_and_romaji(tmp_path):
+    catalog = Catalog(path=str(tmp_path / "catalog.json"))
+    asyncio.run(catalog.sync(FixtureCatalogSource(FIXTURE)))
+
+    assert catalog.search("магичская битва")[0]["id"] == 9002
+    assert catalog.search("kimetsu no yaiba")[0]["id"] == 9004
+    assert catalog.search("Attack on Titan")[0]["id"] == 9000
+    assert catalog.search("евамару")[0]["id"] == 9005
+    assert catalog.search("zzzz qqqq") == []
+
+
+def test_sync_after_downtime_resyncs_whole_catalog(tmp_path):
+    catalog = Catalog(path=str(tmp_path / "catalog.json"))
+    asyncio.run(catalog.sync(FixtureCatalogSource(FIXTURE)))
+
+    # Пока бот не работал, изменились все релизы из последних обновлённых, и ещё один
+    # релиз вне этого окна
+    with open(FIXTURE, encoding="utf-8") as f:
+        releases = json.load(f)
+    for release in releases:
+        release["updated_at"] = "2024-08-01T00:00:00+00:00"
+        release["description"] = f"Обновлено: {release['id']}"
+    # Список каталога приходит без торрентов
+    listed = [{key: value for key, value in release.items() if key != "torrents"} for release in releases]
+    window = [release for release in releases if release["id"] != 9005]
+
+    class Source(_CountingSource):
+        async def pages(self):
+            self.requested.append("pages")
+            yield listed
+
+        async def latest(self):
+            return window
+
+    source = Source(FIXTURE)
+    assert asyncio.run(catalog.sync(source)) == 6
+    assert source.requested == ["pages"]
+    assert catalog.get(9005)["description"] == "Обновлено: 9005"
+    # Торренты изменившихся релизов могли устареть и будут запрошены заново
+    assert "torrents" not in catalog.get(9005)
@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+import service.cluster
+from service.cluster import WEBHOOK_MAX_BODY, Supervisor, WebhookServer
+
+
+class _Supervisor:
+    def __init__(self):
+        self.updates = []
+
+    def dispatch(self, update, data):
+        self.updates.append(data)
+
+
+async def _request(port, head):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(head.encode("latin-1"))
+    await writer.drain()
+    # Тело не отправляем: отказ должен прийти по одним заголовкам
+    status = await asyncio.wait_for(reader.readline(), 2)
+    writer.close()
+    return status.decode("latin-1").strip()
+
+
+def test_webhook_rejects_before_reading_body():
+    async def scenario():
+        supervisor = _Supervisor()
+        server = WebhookServer(bot=None, supervisor=supervisor, path="telegram", secret="s3cret")
+        await server.start("127.0.0.1", 0)
+        port = server._server.sockets[0].getsockname()[1]
+        try:
+            wrong_secret = await _request(
+                port,
+                "POST /telegram HTTP/1.1\r\n"
+                "X-Telegram-Bot-Api-Secret-Token: wrong\r\n"
+                "Content-Length: 100\r\n\r\n",
+            )
+            too_large = await _request(
+                port,
+                "POST /telegram HTTP/1.1\r\n"
+                "X-Telegram-Bot-Api-Secret-Token: s3cret\r\n"
+                f"Content-Length: {WEBHOOK_MAX_BODY + 1}\r\n\r\n",
+            )
+            wrong_path = await _request(port, "POST /other HTTP/1.1\r\nContent-Length: 100\r\n\r\n")
+        finally:
+            await server.stop()
+        return wrong_secret, too_large, wrong_path, supervisor.updates
+
+    wrong_secret, too_large, wrong_path, updates = asyncio.run(scenario())
+    assert wrong_secret == "HTTP/1.1 403 Forbidden"
+    assert too_large == "HTTP/1.1 413 Payload Too Large"
+    assert wrong_path == "HTTP/1.1 404 Not Found"
+    assert updates == []
+
+
+def test_supervisor_backs_off_worker_that_crashes_on_startup(monkeypatch):
+    monkeypatch.setattr(service.cluster, "WATCH_INTERVAL", 0.01)
+    monkeypatch.setattr(service.cluster, "RESTART_DELAY", 0.05)
+
+    class CrashingSupervisor(Supervisor):
+        starts = 0
+
+        def _start_process(self, index):
+            # Обработчик падает сразу, например не может занять порт
+            self.starts += 1
+            return SimpleNamespace(pid=1000 + self.starts, exitcode=1, is_alive=lambda: False)
+
+    async def scenario():
+        supervisor = CrashingSupervisor(target=None, workers=1)
+        supervisor.start()
+        watch = asyncio.create_task(supervisor.watch())
+        await asyncio.sleep(0.5)
+        supervisor._stopping = True
+        await watch
+        return supervisor
+
+    supervisor = asyncio.run(scenario())
+    # Без паузы было бы около 50 перезапусков; с паузами 0.05, 0.1, 0.2 — четыре запуска
+    assert supervisor.starts <= 5
+    assert supervisor._delays[0] >= 0.2
@@ -0,0 +1,90 @@
+import asyncio
+
+import service.jobs
+from service.jobs import JobRegistry, TorrentLeases
+from service.transcode_cache import TranscodeCache
+
+
+def _registry(path, owner):
+    return JobRegistry(leases=TorrentLeases(path=str(path), owner=owner))
+
+
+async def _ignore(*args):
+    pass
+
+
+def test_second_worker_waits_for_owner_instead_of_downloading(tmp_path, monkeypatch):
+    monkeypatch.setattr(service.jobs, "OWNER_POLL_INTERVAL", 0.01)
+    db = tmp_path / "jobs.sqlite3"
+    first, second = _registry(db, 1), _registry(db, 2)
+    # У каждого процесса свой экземпляр кэша над общим каталогом
+    root = str(tmp_path / "transcoded")
+    caches = {first: TranscodeCache(root=root), second: TranscodeCache(root=root)}
+    runs = []
+
+    def runner(registry):
+        async def run(job):
+            runs.append(job)
+            await asyncio.sleep(0.1)
+            source = tmp_path / "episode01.mp4"
+            source.write_bytes(b"video")
+            cache = caches[registry]
+            parts = await cache.put("ABC", "Episode 01.mkv", "p", [str(source)])
+            await cache.put_torrent("ABC", "p", ["Episode 01.mkv"])
+            return [("Episode 01.mkv", parts)]
+        return run
+
+    def follower(registry):
+        # Как follow_download в main.py: серии берутся из кэша сжатых файлов
+        async def follow(job):
+            cached_files = await caches[registry].get_torrent(job.magnet_hash, "p")
+            if cached_files is None:
+                return None
+            for file_name, parts in cached_files:
+                job.publish_episode(file_name, None, parts)
+            return cached_files
+        return follow
+
+    async def scenario():
+        received = []
+
+        async def on_episode(file_name, file_path, parts):
+            received.append((file_name, parts))
+
+        # Процесс давно работает: индекс кэша загружен до этой загрузки
+        await caches[second].usage()
+        owner = asyncio.create_task(
+            first.run("ABC", runner(first), _ignore, _ignore, follower=follower(first))
+        )
+        await asyncio.sleep(0.02)
+        waiting = await second.run("abc", runner(second), _ignore, on_episode, follower=follower(second))
+        return await owner, waiting, received
+
+    owned, waited, received = asyncio.run(scenario())
+    assert len(runs) == 1
+    assert owned == waited
+    assert received == owned
+
+
+def test_waiting_worker_takes_over_when_owner_dies(tmp_path, monkeypatch):
+    monkeypatch.setattr(service.jobs, "OWNER_POLL_INTERVAL", 0.01)
+    db = tmp_path / "jobs.sqlite3"
+    dead = TorrentLeases(path=str(db), owner=1)
+    second = _registry(db, 2)
+
+    async def runner(job):
+        return []
+
+    async def follower(job):
+        raise AssertionError("владелец не закончил загрузку")
+
+    async def scenario():
+        assert await dead.claim("abc")
+        task = asyncio.create_task(second.run("abc", runner, _ignore, _ignore, follower=follower))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        # Супервизор забывает загрузки упавшего процесса
+        await asyncio.to_thread(dead.drop_owner, 1)
+        return await task
+
+    assert asyncio.run(scenario()) == []
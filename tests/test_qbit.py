@@ -0,0 +1,24 @@
+import asyncio
+from types import SimpleNamespace
+
+from service.qbit import QBitGateway
+
+
+def test_concurrent_info_requests_share_one_call():
+    gateway = QBitGateway()
+    calls = []
+
+    async def call(method, **kwargs):
+        calls.append((method, sorted(kwargs["torrent_hashes"])))
+        return [SimpleNamespace(hash="AAAA", progress=0.5), SimpleNamespace(hash="bbbb", progress=1.0)]
+
+    gateway.call = call
+
+    async def scenario():
+        return await asyncio.gather(gateway.info("aaaa"), gateway.info("BBBB"), gateway.info("aaaa"), gateway.info("cccc"))
+
+    first, second, again, missing = asyncio.run(scenario())
+    assert calls == [("torrents_info", ["aaaa", "bbbb", "cccc"])]
+    assert first is again and first.progress == 0.5
+    assert second.progress == 1.0
+    assert missing is None
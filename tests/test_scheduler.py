@@ -0,0 +1,58 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+from service.scheduler import PerChatUpdateProcessor
+
+
+def _update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+def test_busy_chat_does_not_delay_other_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(4)
+        order = []
+
+        async def handle(chat_id, number, duration):
+            await asyncio.sleep(duration)
+            order.append((chat_id, number))
+
+        busy = [
+            asyncio.create_task(processor.process_update(_update(1), handle(1, number, 0.2)))
+            for number in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await processor.process_update(_update(2), handle(2, 0, 0))
+        other_chat = time.perf_counter() - started
+        await asyncio.gather(*busy)
+        # Очередь чата 1 выполняется задачей первого обновления
+        while processor.stats()["chats"]:
+            await asyncio.sleep(0.05)
+        return other_chat, order
+
+    other_chat, order = asyncio.run(scenario())
+    assert other_chat < 0.1
+    assert [number for chat_id, number in order if chat_id == 1] == [0, 1, 2, 3, 4]
+
+
+def test_updates_of_one_chat_run_one_at_a_time():
+    async def scenario():
+        processor = PerChatUpdateProcessor(8)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(_update(7), handle()) for _ in range(5)))
+        while processor.stats()["chats"]:
+            await asyncio.sleep(0.01)
+        return peak
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,72 @@
+import asyncio
+
+from service.transcode_cache import TranscodeCache
+
+
+def _write(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_shrink_skips_pinned_torrents(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path / "cache"), max_bytes=10 ** 6)
+
+    async def scenario():
+        await cache.put("AAA", "Episode 01.mkv", "p", [_write(tmp_path / "a.mp4", 100)])
+        await cache.put("BBB", "Episode 01.mkv", "p", [_write(tmp_path / "b.mp4", 100)])
+        with cache.pinned("aaa"):
+            # Запись AAA старше, но её файлы ещё отправляются
+            freed = await cache.shrink(100)
+            pinned = await cache.get("AAA", "Episode 01.mkv", "p")
+        evicted = await cache.get("BBB", "Episode 01.mkv", "p")
+        freed_after = await cache.shrink(0)
+        return freed, pinned, evicted, freed_after
+
+    freed, pinned, evicted, freed_after = asyncio.run(scenario())
+    assert freed == 100
+    assert pinned is not None
+    assert evicted is None
+    assert freed_after == 100
+
+
+def test_entries_written_by_another_process_are_visible(tmp_path):
+    root = str(tmp_path / "cache")
+    owner, follower = TranscodeCache(root=root), TranscodeCache(root=root)
+
+    async def scenario():
+        # Второй процесс загрузил индекс до того, как первый что-то записал
+        assert await follower.get_torrent("AAA", "p") is None
+        await owner.put("AAA", "Episode 01.mkv", "p", [_write(tmp_path / "a.mp4", 100)])
+        await owner.put_torrent("AAA", "p", ["Episode 01.mkv"])
+        return await follower.get_torrent("aaa", "p")
+
+    files = asyncio.run(scenario())
+    assert [name for name, _ in files] == ["Episode 01.mkv"]
+    assert open(files[0][1][0], "rb").read() == b"x" * 100
+    assert follower.size == 100
+
+
+def test_usage_and_shrink_cover_entries_of_other_processes(tmp_path):
+    root = str(tmp_path / "cache")
+    first, second = TranscodeCache(root=root), TranscodeCache(root=root)
+
+    async def in_use(torrent_hash):
+        # Торрент CCC ещё раздаётся в другом процессе
+        return torrent_hash == "ccc"
+
+    async def scenario():
+        await first.usage()
+        await second.put("CCC", "Episode 01.mkv", "p", [_write(tmp_path / "c.mp4", 100)])
+        await second.put("AAA", "Episode 01.mkv", "p", [_write(tmp_path / "a.mp4", 100)])
+        await first.put("BBB", "Episode 01.mkv", "p", [_write(tmp_path / "b.mp4", 100)])
+        usage = await first.usage()
+        # Самые старые записи написал второй процесс: CCC занят, поэтому вытесняется AAA
+        freed = await first.shrink(200, in_use=in_use)
+        return usage, freed, await second.usage()
+
+    usage, freed, left = asyncio.run(scenario())
+    assert usage == 300
+    assert freed == 100
+    assert left == 200
+    assert asyncio.run(second.get("AAA", "Episode 01.mkv", "p")) is None
+    assert asyncio.run(second.get("CCC", "Episode 01.mkv", "p")) is not None
@@ -0,0 +1,105 @@
+import os
+import shutil
+import asyncio
+import subprocess
+
+import pytest
+
+from service.transcoder import (
+    FFMPEG, FFPROBE, MAX_UPLOAD_SIZE, Transcoder, split_count, target_video_kbps,
+)
+
+requires_ffmpeg = pytest.mark.skipif(
+    shutil.which(FFMPEG) is None or shutil.which(FFPROBE) is None, reason="ffmpeg не установлен"
+)
+
+
+def _clip(path, duration, size):
+    subprocess.run(
+        [
+            FFMPEG, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc=duration={duration}:size={size}:rate=25",
+            "-f", "lavfi", "-i", f"sine=duration={duration}",
+            "-c:v", "mpeg4", "-q:v", "5", "-c:a", "aac", "-shortest", str(path),
+        ],
+        check=True,
+    )
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def short_clip(tmp_path_factory):
+    return _clip(tmp_path_factory.mktemp("clips") / "short.mkv", 2, "160x120")
+
+
+@pytest.fixture(scope="module")
+def long_clip(tmp_path_factory):
+    # Достаточно длинный, чтобы успеть отменить сжатие на середине
+    return _clip(tmp_path_factory.mktemp("clips") / "long.mkv", 60, "640x480")
+
+
+async def _idle(transcoder):
+    while transcoder.running or transcoder.queued:
+        await asyncio.sleep(0.05)
+
+
+def test_target_bitrate_never_exceeds_source():
+    # Источник меньше бюджета: битрейт не поднимается выше исходного
+    assert target_video_kbps(10 * 60, source_kbps=400) == 400 - 128
+    assert target_video_kbps(10 * 60, source_kbps=10_000) == target_video_kbps(10 * 60)
+
+
+def test_file_that_fits_at_source_bitrate_is_not_split():
+    two_hours = 2 * 60 * 60
+    assert split_count(two_hours) > 1
+    fits = MAX_UPLOAD_SIZE * 8 / 1000 / two_hours * 0.9
+    assert split_count(two_hours, source_kbps=fits) == 1
+
+
+@requires_ffmpeg
+def test_transcode_reports_progress_and_writes_output(short_clip, tmp_path):
+    output_path = str(tmp_path / "short.mp4")
+
+    async def scenario():
+        transcoder = Transcoder(workers=1)
+        reported = []
+        try:
+            job = transcoder.submit(short_clip, output_path, on_progress=lambda job: reported.append(job.progress))
+            outputs = await job.wait()
+        finally:
+            await transcoder.stop()
+        return job, outputs, reported
+
+    job, outputs, reported = asyncio.run(scenario())
+    assert outputs == [output_path]
+    assert os.path.getsize(output_path) > 0
+    assert job.state == "done"
+    assert reported[-1] == 1.0
+    assert reported == sorted(reported)
+
+
+@requires_ffmpeg
+def test_cancel_removes_partial_output(long_clip, tmp_path):
+    output_path = str(tmp_path / "long.mp4")
+
+    async def scenario():
+        transcoder = Transcoder(workers=1)
+        started = asyncio.Event()
+        try:
+            job = transcoder.submit(
+                long_clip, output_path, args=["-c:v", "libx264", "-preset", "veryslow", "-an"],
+                on_progress=lambda job: started.set(),
+            )
+            await asyncio.wait_for(started.wait(), 30)
+            job.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await job.wait()
+            await asyncio.wait_for(_idle(transcoder), 30)
+        finally:
+            await transcoder.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.cancelled
+    assert job.progress < 1.0
+    assert not os.path.exists(output_path)